@@ -0,0 +1,274 @@
+import sys
+import json
+import pickle
+import time
+import timeit
+import platform
+import argparse
+import numpy as np
+from sim import Simulation
+from ward import Ward
+from person import Worker
+from engine import VectorizedEngine
+from particle import PriorityQueue, DecayQueue, ParticleManager, ArrayParticleManager
+
+# Ward sizes (bays per side, beds per side of each bay, workers) and particle loads the benchmarks are run at
+WARD_SIZES = [(2, 3, 7), (4, 5, 20), (8, 6, 40)]
+PARTICLE_LOADS = [100, 1000, 10000]
+PARTICLE_MANAGERS = {"object": ParticleManager, "array": ArrayParticleManager}
+
+# Floor sizes (wards, workers) the per-timestep cost is measured at, every ward has 3 bays per side and 3 beds per side of each bay (36 beds)
+FLOOR_SIZES = [(1, 6), (2, 12), (4, 24), (8, 48), (16, 96)]
+FLOOR_BAYS = 3
+FLOOR_BEDS = 3
+FLOOR_TIMESTEPS = 30 # Timesteps run by each timed call
+
+# Time a function, calling it enough times per repeat to take at least 0.2 seconds
+# If a setup function is given it is called (untimed) before every call instead, and each repeat is a single call
+# Returns the number of calls per repeat and the time per call of each repeat
+def time_function(function, repeat=5, setup=None):
+    if setup is not None:
+        times = []
+        for _ in range(repeat):
+            setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return 1, times
+    
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number, [total / number for total in timer.repeat(repeat, number)]
+
+def make_ward(bays, beds):
+    return Ward(bays=bays, beds=beds, bay_length=12, bay_width=8, corridor_width=4)
+
+# Fill a particle manager with about load particles around the beds of a ward
+def make_particle_manager(backend, ward, load, seed=0):
+    manager = PARTICLE_MANAGERS[backend](half_life=1, spread=3.95, mean_particles=8, ward=ward, rng=np.random.default_rng(seed))
+    origins = np.array(ward.bed_positions)
+    while len(manager) < load:
+        manager.create_particles_batch(0, origins)
+    return manager
+
+# Each benchmark yields (parameters, function to time) for every size it is run at, or (parameters, function to time, setup) if the function needs its state reset before every call
+
+# Push then pop n items
+def benchmark_priority_queue(sizes, loads):
+    rng = np.random.default_rng(0)
+    for queue_class in [PriorityQueue, DecayQueue]:
+        for n in loads:
+            priorities = rng.uniform(0, 100, n)
+            
+            def push_pop(queue_class=queue_class, priorities=priorities):
+                queue = queue_class()
+                for i, priority in enumerate(priorities):
+                    queue.push(i, priority)
+                if queue_class is PriorityQueue:
+                    for _ in range(len(priorities)):
+                        queue.pop()
+                else:
+                    queue.pop_due(100)
+            
+            yield {"queue": queue_class.__name__, "items": n}, push_pop
+
+# One timestep of particle creation for every patient, and decay
+def benchmark_create_particles(sizes, loads):
+    for backend in PARTICLE_MANAGERS:
+        for bays, beds, _ in sizes:
+            ward = make_ward(bays, beds)
+            manager = make_particle_manager(backend, ward, 0)
+            origins = np.array(ward.bed_positions)
+            timesteps = iter(range(sys.maxsize))
+            
+            def create(manager=manager, origins=origins, timesteps=timesteps):
+                timestep = next(timesteps)
+                manager.create_particles_batch(timestep, origins)
+                manager.update(timestep)
+            
+            yield {"backend": backend, "bays": bays, "beds": beds}, create
+
+# Particles around a single position, and the number of particles around every bed at once
+def benchmark_check_for_particles(sizes, loads):
+    bays, beds, _ = sizes[0]
+    ward = make_ward(bays, beds)
+    position = np.array(ward.bed_positions[0])
+    positions = np.array(ward.bed_positions)
+    for backend in PARTICLE_MANAGERS:
+        for load in loads:
+            manager = make_particle_manager(backend, ward, load)
+            yield {"backend": backend, "particles": load, "query": "single"}, lambda manager=manager: manager.check_for_particles(position, 0.2)
+            yield {"backend": backend, "particles": load, "query": "batch"}, lambda manager=manager: manager.count_particles(positions, 0.2)
+
+# Room of 1000 positions spread over the ward, one at a time and in one batch
+def benchmark_get_room(sizes, loads):
+    for bays, beds, _ in sizes:
+        ward = make_ward(bays, beds)
+        x0, y0, x1, y1 = np.nanmin(ward.room_bounds[:, :2], axis=0).tolist() + np.nanmax(ward.room_bounds[:, 2:], axis=0).tolist()
+        positions = np.random.default_rng(0).uniform([x0 - 1, y0 - 1], [x1 + 1, y1 + 1], (1000, 2))
+        
+        yield {"bays": bays, "beds": beds, "query": "single"}, lambda ward=ward, positions=positions: [ward.get_room(position) for position in positions]
+        yield {"bays": bays, "beds": beds, "query": "batch"}, lambda ward=ward, positions=positions: ward.get_rooms(positions)
+
+# One movement step of every worker in a simulation
+def benchmark_worker_move(sizes, loads):
+    for bays, beds, num_workers in sizes:
+        sim = Simulation(seed=0, bays=bays, beds=beds, num_workers=num_workers)
+        
+        def move(sim=sim):
+            target_positions = [worker.update_target(sim.ward) for worker in sim.workers]
+            proposals = Worker.propose_moves(sim.workers, sim.ward)
+            for worker, target_position, proposal in zip(sim.workers, target_positions, proposals):
+                worker.move(target_position, sim.ward, proposal)
+        
+        yield {"bays": bays, "beds": beds, "workers": num_workers}, move
+
+# A whole simulation replicate of an hour (360 timesteps), including creating it
+def benchmark_simulation_run(sizes, loads):
+    for engine in ["object", "vectorized"]:
+        for bays, beds, num_workers in sizes:
+            seeds = iter(range(sys.maxsize))
+            
+            def run(engine=engine, bays=bays, beds=beds, num_workers=num_workers, seeds=seeds):
+                Simulation(max_timesteps=360, engine=engine, seed=next(seeds), bays=bays, beds=beds, num_workers=num_workers).run(progress=False)
+            
+            yield {"engine": engine, "bays": bays, "beds": beds, "workers": num_workers}, run
+
+# FLOOR_TIMESTEPS timesteps of a simulation of a floor against the number of beds on it
+# The simulation is run for an hour (360 timesteps) to build up the particles, then every call starts again from a snapshot taken there,
+# so every call (and every run of the benchmark) does the same work
+def benchmark_floor_timestep(floors):
+    for engine in ["object", "vectorized"]:
+        for wards, num_workers in floors:
+            sim = Simulation(seed=0, engine=engine, wards=wards, bays=FLOOR_BAYS, beds=FLOOR_BEDS, num_workers=num_workers)
+            vectorized_engine = VectorizedEngine([sim]) if engine == "vectorized" else None
+            for timestep in range(360):
+                step(sim, vectorized_engine, timestep)
+            
+            snapshot = pickle.dumps((sim, vectorized_engine), protocol=pickle.HIGHEST_PROTOCOL)
+            state = {}
+            
+            def restore(snapshot=snapshot, state=state):
+                state["sim"], state["engine"] = pickle.loads(snapshot)
+            
+            def run(state=state):
+                for timestep in range(360, 360 + FLOOR_TIMESTEPS):
+                    step(state["sim"], state["engine"], timestep)
+            
+            yield {"engine": engine, "wards": wards, "beds": len(sim.patients), "workers": num_workers, "rooms": sim.ward.outside_id, "timesteps": FLOOR_TIMESTEPS}, run, restore
+
+# Advance a simulation by one timestep with its engine
+def step(sim, vectorized_engine, timestep):
+    if vectorized_engine is not None:
+        vectorized_engine.step(timestep)
+    else:
+        sim.update_objects(timestep)
+
+BENCHMARKS = {
+    "PriorityQueue.push/pop": benchmark_priority_queue,
+    "ParticleManager.create_particles": benchmark_create_particles,
+    "ParticleManager.check_for_particles": benchmark_check_for_particles,
+    "Ward.get_room": benchmark_get_room,
+    "Worker.move": benchmark_worker_move,
+    "Simulation.run": benchmark_simulation_run
+}
+
+# Benchmarks run at each floor size rather than each ward size and particle load
+SCALING_BENCHMARKS = {
+    "Simulation.timestep": benchmark_floor_timestep
+}
+
+# Run the benchmarks whose names contain the filter, returning a list of results with the median and minimum time per call
+def run_benchmarks(sizes=WARD_SIZES, loads=PARTICLE_LOADS, repeat=5, name_filter="", floors=FLOOR_SIZES):
+    results = []
+    benchmarks = [(name, benchmark(sizes, loads)) for name, benchmark in BENCHMARKS.items()] + [(name, benchmark(floors)) for name, benchmark in SCALING_BENCHMARKS.items()]
+    for name, runs in benchmarks:
+        if name_filter not in name:
+            continue
+        
+        for parameters, function, *setup in runs:
+            number, times = time_function(function, repeat, *setup)
+            results.append({
+                "name": name,
+                "parameters": parameters,
+                "number": number,
+                "times": times,
+                "median": float(np.median(times)),
+                "min": min(times)
+            })
+            print(f"{name} {parameters}: {format_time(results[-1]['median'])} per call")
+    
+    return results
+
+# Print the per-timestep cost of the scaling benchmarks against the number of beds
+def print_scaling(results):
+    for result in results:
+        if result["name"] in SCALING_BENCHMARKS:
+            parameters = result["parameters"]
+            timestep_time = result["min"] / parameters["timesteps"]
+            print(f"{parameters['engine']:>10} {parameters['beds']:5d} beds {parameters['workers']:4d} workers {parameters['rooms']:4d} rooms: {format_time(timestep_time)} per timestep, {format_time(timestep_time / parameters['beds'])} per bed")
+
+def format_time(seconds):
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+# Key that identifies the same benchmark in different result files
+def get_result_key(result):
+    return result["name"] + " " + json.dumps(result["parameters"], sort_keys=True)
+
+# Save results as JSON along with the machine and library versions they were measured on
+def save_benchmark_results(filename, results):
+    with open(filename, "w") as file:
+        json.dump({
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(), "numpy": np.__version__},
+            "results": results
+        }, file, indent=2)
+
+def load_benchmark_results(filename):
+    with open(filename, "r") as file:
+        return json.load(file)["results"]
+
+# Compare results with a baseline, a benchmark has regressed if its minimum time is more than tolerance (a fraction) slower than the baseline's
+# The minimum is used as it is the least affected by other work on the machine
+# Returns (key, ratio of the minimum times, regressed) for every benchmark in both
+def compare_benchmark_results(results, baseline, tolerance=0.25):
+    baseline_times = {get_result_key(result): result["min"] for result in baseline}
+    comparisons = []
+    for result in results:
+        key = get_result_key(result)
+        if key in baseline_times:
+            ratio = result["min"] / baseline_times[key]
+            comparisons.append((key, ratio, ratio > 1 + tolerance))
+    return comparisons
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths")
+    parser.add_argument("--output", default="data/benchmark.json", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON results to compare against, exits with an error if anything has regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Fraction slower than the baseline counted as a regression")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose names contain this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Only run the smallest ward size, particle load and floor sizes")
+    args = parser.parse_args()
+    
+    sizes, loads, floors = (WARD_SIZES[:1], PARTICLE_LOADS[:1], FLOOR_SIZES[:2]) if args.quick else (WARD_SIZES, PARTICLE_LOADS, FLOOR_SIZES)
+    results = run_benchmarks(sizes, loads, args.repeat, args.filter, floors)
+    print_scaling(results)
+    save_benchmark_results(args.output, results)
+    print(f"Saved {len(results)} results to {args.output}")
+    
+    if args.baseline is not None:
+        comparisons = compare_benchmark_results(results, load_benchmark_results(args.baseline), args.tolerance)
+        for key, ratio, regressed in comparisons:
+            print(f"{'REGRESSED' if regressed else 'ok':>9} {ratio:6.2f}x {key}")
+        
+        regressions = sum(regressed for _, _, regressed in comparisons)
+        print(f"{regressions} of {len(comparisons)} benchmarks regressed by more than {args.tolerance:.0%}")
+        if regressions > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import unittest
+from benchmark import run_benchmarks, compare_benchmark_results
+
+class TestBenchmark(unittest.TestCase):
+    def test_results_and_comparison(self):
+        results = run_benchmarks(sizes=[(2, 3, 7)], loads=[100], repeat=2, name_filter="Ward.get_room")
+        self.assertEqual([result["parameters"]["query"] for result in results], ["single", "batch"])
+        self.assertTrue(all(len(result["times"]) == 2 and result["min"] > 0 for result in results))
+        
+        # Only the benchmark that is more than 25% slower than the baseline has regressed
+        baseline = [dict(result, min=result["min"] * 2) for result in results[:1]] + [dict(result, min=result["min"] / 2) for result in results[1:]]
+        comparisons = compare_benchmark_results(results, baseline)
+        self.assertEqual([regressed for _, _, regressed in comparisons], [False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import numpy as np
+from tqdm import tqdm
+from particle import ArrayParticleManager
+from ward import PATH, PATIENT
+
+# Vectorised stepping engine, keeping the state of every person in NumPy arrays and advancing a whole timestep with array operations
+# Several independent simulations (replicates) can be advanced together, every state array has a leading replicate axis
+class VectorizedEngine:
+    def __init__(self, sims):
+        self.sims = sims
+        self.num_replicates = len(sims)
+        self.ward = sims[0].ward
+        
+        # A single simulation keeps its own particle managers, an ensemble shares one manager per particle type with particles grouped by replicate
+        if self.num_replicates == 1:
+            self.airborne_particles = sims[0].airborne_particles
+            self.surface_particles = sims[0].surface_particles
+        else:
+            sim = sims[0]
+            self.airborne_particles = ArrayParticleManager(half_life=sim.airborne_half_life, spread=sim.airborne_spread, mean_particles=sim.airborne_mean_particles, ward=self.ward)
+            self.surface_particles = ArrayParticleManager(half_life=sim.surface_half_life, spread=sim.surface_spread, mean_particles=sim.surface_mean_particles, ward=self.ward)
+        
+        # Every replicate draws from its own generators, so its results do not depend on which other replicates it is run with
+        self.airborne_rngs = [sim.airborne_particles.rng for sim in sims]
+        self.surface_rngs = [sim.surface_particles.rng for sim in sims]
+        
+        # People are stored workers first, then patients
+        self.people = [sim.workers + sim.patients for sim in sims]
+        self.num_workers = len(sims[0].workers)
+        self.num_people = len(self.people[0])
+        self.types = np.array(["worker"] * len(sims[0].workers) + ["patient"] * len(sims[0].patients))
+        self.ids = np.array([[person.id for person in people] for people in self.people])
+        
+        # Infections in the same timestep are recorded patients first, then workers, the same as Simulation.update_objects
+        self.record_order = np.concatenate([np.arange(self.num_workers, self.num_people), np.arange(self.num_workers)])
+        
+        # People state
+        self.positions = np.array([[person.position for person in people] for people in self.people], dtype=float)
+        self.infected = np.array([[person.infected for person in people] for people in self.people])
+        self.masked = np.array([[person.masked for person in people] for people in self.people])
+        self.vaccinated = np.array([[person.vaccinated for person in people] for people in self.people])
+        self.infection_probability = np.array([[person.infection_probability for person in people] for people in self.people])
+        self.reduction_particles = np.where(self.masked, [[person.masked_airborne_reduction_particles for person in people] for people in self.people], 1.0)
+        self.reduction_spread = np.where(self.masked, [[person.masked_airborne_reduction_spread for person in people] for people in self.people], 1.0)
+        self.recorded = self.infected.copy()
+        
+        # Replicates that are still running (i.e. not everyone is infected)
+        self.active = np.ones(self.num_replicates, dtype=bool)
+        
+        # Worker state
+        shape = (self.num_replicates, self.num_workers)
+        self.directions = np.array([[worker.direction for worker in sim.workers] for sim in sims], dtype=float).reshape(shape + (2,))
+        self.step_lengths = np.array([[worker.step_length for worker in sim.workers] for sim in sims], dtype=float).reshape(shape)
+        self.patient_order = np.array([[[sim.patients.index(patient) for patient in worker.patient_list] for worker in sim.workers] for sim in sims], dtype=int).reshape(shape + (-1,))
+        self.patient_cursor = np.zeros(shape, dtype=int) # Patients are visited by rolling the patient list, so the cursor counts back from the start
+        self.target_patients = np.array([[sim.patients.index(worker.target_patient) for worker in sim.workers] for sim in sims], dtype=int).reshape(shape)
+        
+        # Each worker's route in the ward's routing table (from its start room to its patient's bay) and the leg of it currently targeted
+        self.patient_rooms = self.ward.get_rooms(self.positions[:, self.num_workers:].reshape(-1, 2)).reshape(self.num_replicates, -1)
+        self.route_starts = np.array([[worker.route[0] for worker in sim.workers] for sim in sims], dtype=int).reshape(shape)
+        self.route_ends = np.array([[worker.route[1] for worker in sim.workers] for sim in sims], dtype=int).reshape(shape)
+        self.target_legs = np.array([[worker.route_cursor for worker in sim.workers] for sim in sims], dtype=int).reshape(shape)
+        
+        # Timers and counters of an instrumented run (see Simulation.run)
+        self.instrumentation = None
+    
+    # Get the first leg after the current target leg that has a target position
+    def next_target_legs(self, r, w):
+        return self.ward.route_next_targets[self.route_starts[r, w], self.route_ends[r, w], self.target_legs[r, w] + 1]
+    
+    # Get the type, room and position of each worker's current target
+    def get_targets(self, r, w):
+        route = (self.route_starts[r, w], self.route_ends[r, w], self.target_legs[r, w])
+        target_types = self.ward.route_types[route]
+        target_points = self.ward.route_points[route]
+        
+        # The patient leg targets the position of the worker's patient
+        at_patient = target_types == PATIENT
+        target_points[at_patient] = self.positions[r[at_patient], self.num_workers + self.target_patients[r[at_patient], w[at_patient]]]
+        
+        return target_types, self.ward.route_rooms[route], target_points
+    
+    # Get the rooms each worker can move into from its current room: the room itself and the next room along the path (if there is one)
+    def get_allowed_rooms(self, r, w, current_rooms):
+        return self.ward.get_allowed_rooms(self.route_starts[r, w], self.route_ends[r, w], current_rooms)
+    
+    # Draw a block of uniform random numbers for each of the given (sorted) replicates from one of their generators
+    def draw_uniform(self, replicates, rng_name, shape, low=0, high=1):
+        values = np.empty((len(replicates),) + shape)
+        for r in np.unique(replicates):
+            rows = replicates == r
+            values[rows] = getattr(self.sims[r], rng_name).uniform(low, high, (np.count_nonzero(rows),) + shape)
+        return values
+    
+    # Create the particles for all infected people
+    def emit_particles(self, timestep):
+        r, i = np.nonzero(self.infected & self.active[:, None])
+        if len(r) == 0:
+            return
+        
+        self.airborne_particles.create_particles_batch(timestep, self.positions[r, i], self.reduction_particles[r, i], self.reduction_spread[r, i], groups=r, rngs=self.airborne_rngs)
+        unmasked = ~self.masked[r, i]
+        self.surface_particles.create_particles_batch(timestep, self.positions[r[unmasked], i[unmasked]], groups=r[unmasked], rngs=self.surface_rngs)
+    
+    # Check all uninfected people for particle collisions and infect them
+    def check_exposure(self, head_radius=0.2):
+        # Every active replicate draws one random number per person each timestep
+        replicates = np.flatnonzero(self.active)
+        random_values = np.zeros((self.num_replicates, self.num_people))
+        random_values[replicates] = self.draw_uniform(replicates, "exposure_rng", (self.num_people,))
+        
+        r, i = np.nonzero(~self.infected & self.active[:, None])
+        if len(r) == 0:
+            return
+        
+        positions = self.positions[r, i]
+        total_collisions = self.airborne_particles.count_particles(positions, head_radius, groups=r) + self.surface_particles.count_particles(positions, head_radius, groups=r)
+        
+        exposed = total_collisions > 0
+        r, i = r[exposed], i[exposed]
+        acceptance_probability = 1 - (1 - self.infection_probability[r, i]) ** total_collisions[exposed]
+        infected = random_values[r, i] < acceptance_probability
+        self.infected[r[infected], i[infected]] = True
+    
+    # Retarget workers that have reached their patient or a point on their path
+    def update_targets(self, r, w):
+        target_types, _, target_points = self.get_targets(r, w)
+        reached = np.linalg.norm(self.positions[r, w] - target_points, axis=1) < self.step_lengths[r, w]
+        
+        # Workers that reached their patient move on to the next patient (the patient list is rolled by one), on the route from their current room
+        at_patient = reached & (target_types == PATIENT)
+        rp, wp = r[at_patient], w[at_patient]
+        self.patient_cursor[rp, wp] = (self.patient_cursor[rp, wp] - 1) % self.patient_order.shape[2]
+        self.target_patients[rp, wp] = self.patient_order[rp, wp, self.patient_cursor[rp, wp]]
+        self.route_starts[rp, wp] = self.ward.get_rooms(self.positions[rp, wp])
+        self.route_ends[rp, wp] = self.patient_rooms[rp, self.target_patients[rp, wp]]
+        self.target_legs[rp, wp] = self.ward.route_next_targets[self.route_starts[rp, wp], self.route_ends[rp, wp], 0]
+        
+        # Workers that reached a point on their path move on to the next target
+        on_path = reached & (target_types == PATH)
+        self.target_legs[r[on_path], w[on_path]] = self.next_target_legs(r[on_path], w[on_path])
+    
+    # Move workers one step, sampling each proposed direction directly from the directions that keep the worker in an allowed room
+    def move_workers(self, r, w):
+        positions = self.positions[r, w]
+        step_lengths = self.step_lengths[r, w]
+        current_rooms = self.ward.get_rooms(positions)
+        
+        # Each worker uses two random numbers per step, one for the proposed direction and one to accept it
+        random_values = self.draw_uniform(r, "movement_rng", (2,))
+        step_arcs = self.ward.get_step_arcs(positions, step_lengths, self.get_allowed_rooms(r, w, current_rooms))
+        proposed_directions = self.ward.sample_step_directions(*step_arcs, random_values[:, 0])
+        stuck = np.isnan(proposed_directions[:, 0])
+        proposed_directions[stuck] = self.directions[r[stuck], w[stuck]]
+        
+        # Accept the new directions with a probability based on the angle to the target
+        _, target_rooms, target_points = self.get_targets(r, w)
+        direction_to_target = target_points - positions
+        cos_angle = np.sum(direction_to_target * proposed_directions, axis=1) / np.linalg.norm(direction_to_target, axis=1)
+        angle = np.arccos(np.clip(cos_angle, -1, 1))
+        acceptance_probability = (np.pi - angle) / np.pi
+        accepted = random_values[:, 1] < acceptance_probability
+        self.directions[r[accepted], w[accepted]] = proposed_directions[accepted]
+        
+        # Move the workers whose direction is valid
+        moving = self.ward.is_step_open(*step_arcs, self.directions[r, w])
+        new_positions = positions + step_lengths[:, None] * self.directions[r, w]
+        new_rooms = self.ward.get_rooms(new_positions)
+        self.positions[r[moving], w[moving]] = new_positions[moving]
+        if self.instrumentation is not None:
+            self.instrumentation.count("proposals", len(r))
+            self.instrumentation.count("proposals_accepted", np.count_nonzero(accepted))
+            self.instrumentation.count("moves_blocked", np.count_nonzero(~moving))
+        
+        # Workers that moved into a new room while their target is still in the previous one move onto the next target
+        skipped = moving & (new_rooms != current_rooms) & (target_rooms != new_rooms) & (target_rooms == current_rooms)
+        self.target_legs[r[skipped], w[skipped]] = self.next_target_legs(r[skipped], w[skipped])
+    
+    # Advance every active replicate by one timestep, returning the number of infected people in each replicate
+    def step(self, timestep):
+        timer = self.instrumentation
+        if timer is not None:
+            timer.start()
+        
+        self.emit_particles(timestep)
+        if timer is not None:
+            timer.lap("emission")
+        self.check_exposure()
+        if timer is not None:
+            timer.lap("exposure")
+        
+        r, w = np.nonzero(np.broadcast_to(self.active[:, None], (self.num_replicates, self.num_workers)))
+        self.update_targets(r, w)
+        if timer is not None:
+            timer.lap("targets")
+        self.move_workers(r, w)
+        if timer is not None:
+            timer.lap("movement")
+        
+        self.airborne_particles.update(timestep)
+        self.surface_particles.update(timestep)
+        if timer is not None:
+            timer.lap("decay")
+        
+        # Add the new infections to the infection records
+        new_infections = (self.infected & ~self.recorded)[:, self.record_order]
+        for r, i in zip(*np.nonzero(new_infections)):
+            i = self.record_order[i]
+            self.sims[r].infection_record.append({
+                "type": str(self.types[i]),
+                "id": str(self.ids[r, i]),
+                "timestep": timestep
+            })
+        self.recorded[:] = self.infected
+        
+        # Stop advancing the replicates where everyone is infected
+        total_infected = np.count_nonzero(self.infected, axis=1)
+        for r in np.flatnonzero(self.active):
+            self.sims[r].total_infected = int(total_infected[r])
+        self.active &= total_infected < self.num_people
+        if timer is not None:
+            timer.lap("records")
+        
+        return total_infected
+    
+    # Run every replicate until the maximum number of timesteps is reached or everyone is infected
+    def run(self, max_timesteps, progress=True):
+        for timestep in tqdm(range(max_timesteps), disable=not progress):
+            self.step(timestep)
+            if not self.active.any():
+                break
+        
+        self.sync()
+    
+    # Write the array state back to the Person objects
+    def sync(self):
+        for r, sim in enumerate(self.sims):
+            for i, person in enumerate(self.people[r]):
+                person.position = self.positions[r, i].copy()
+                person.infected = bool(self.infected[r, i])
+            for w, worker in enumerate(sim.workers):
+                worker.direction = self.directions[r, w].copy()
+                worker.target_patient = sim.patients[self.target_patients[r, w]]
+                worker.patient_list = [sim.patients[p] for p in np.roll(self.patient_order[r, w], -self.patient_cursor[r, w])]
+                worker.route = (int(self.route_starts[r, w]), int(self.route_ends[r, w]))
+                worker.route_cursor = int(self.target_legs[r, w])
@@ -0,0 +1,142 @@
+import unittest
+import numpy as np
+from sim import Simulation
+from engine import VectorizedEngine
+from person import Worker
+from ward import PATH
+
+class TestVectorizedEngine(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.sim = Simulation(max_timesteps=50, engine="vectorized", seed=0)
+        self.engine = VectorizedEngine([self.sim])
+    
+    def test_rooms_match_ward(self):
+        positions = np.random.uniform([-15, -1], [15, 17], (200, 2))
+        rooms = self.sim.ward.get_rooms(positions)
+        
+        self.assertEqual([self.sim.ward.room_names[room] for room in rooms], [self.sim.ward.get_room(position) for position in positions])
+    
+    def test_moves_stay_in_allowed_rooms(self):
+        # Every step stays in the worker's room or moves into the next room on its route, on a ward and on a floor
+        floor_sim = Simulation(max_timesteps=50, engine="vectorized", seed=0, wards=3, bays=2, beds=2, num_workers=10)
+        for sim, engine in [(self.sim, self.engine), (floor_sim, VectorizedEngine([floor_sim]))]:
+            w = np.arange(engine.num_workers)
+            r = np.zeros_like(w)
+            for _ in range(300):
+                engine.update_targets(r, w)
+                allowed_rooms = engine.get_allowed_rooms(r, w, sim.ward.get_rooms(engine.positions[r, w]))
+                engine.move_workers(r, w)
+                self.assertTrue((allowed_rooms == sim.ward.get_rooms(engine.positions[r, w])[:, None]).any(axis=1).all())
+    
+    def test_worker_moves_stay_in_allowed_rooms(self):
+        # The same check for Person objects, moved with propose_moves and Worker.move as Simulation.update_objects does
+        sim = Simulation(max_timesteps=50, seed=0)
+        ward = sim.ward
+        for _ in range(300):
+            target_positions = [worker.update_target(ward) for worker in sim.workers]
+            allowed_rooms = [ward.get_allowed_rooms(*worker.route, ward.get_room_id(worker.position))[0] for worker in sim.workers]
+            for worker, target_position, proposal in zip(sim.workers, target_positions, Worker.propose_moves(sim.workers, ward)):
+                worker.move(target_position, ward, proposal)
+            self.assertTrue(all(ward.get_room_id(worker.position) in rooms for worker, rooms in zip(sim.workers, allowed_rooms)))
+    
+    def test_stuck_worker_stays_still(self):
+        worker = self.sim.workers[0]
+        position = worker.position.copy()
+        
+        # A stuck worker's proposal is its current direction, which is blocked, so accepting it doesn't move the worker
+        accepted, moving = worker.move(position + [1.0, 0.0], self.sim.ward, (worker.direction.copy(), 0.0, False, False))
+        self.assertTrue(accepted)
+        self.assertFalse(moving)
+        self.assertEqual(worker.position.tolist(), position.tolist())
+    
+    def test_step_directions_match_rejection_sampling(self):
+        ward = self.sim.ward
+        rng = np.random.default_rng(0)
+        n = 50000
+        position = np.array([-1.8, 3.0])
+        allowed_rooms = np.array([ward.corridor_id, 0])
+        
+        step_arcs = ward.get_step_arcs(np.tile(position, (n, 1)), np.full(n, 0.5), np.tile(allowed_rooms, (n, 1)))
+        directions = ward.sample_step_directions(*step_arcs, rng.uniform(0, 1, n))
+        self.assertTrue(np.isin(ward.get_rooms(position + 0.5 * directions), allowed_rooms).all())
+        
+        proposals = rng.uniform(-1, 1, (4 * n, 2))
+        proposals /= np.linalg.norm(proposals, axis=1)[:, None]
+        proposals = proposals[np.isin(ward.get_rooms(position + 0.5 * proposals), allowed_rooms)]
+        
+        sampled, _ = np.histogram(np.arctan2(directions[:, 1], directions[:, 0]), bins=24, range=(-np.pi, np.pi))
+        rejected, _ = np.histogram(np.arctan2(proposals[:, 1], proposals[:, 0]), bins=24, range=(-np.pi, np.pi))
+        self.assertLess(np.max(np.abs(sampled / n - rejected / len(proposals))), 0.01)
+    
+    def test_run_records_each_infection_once(self):
+        self.sim.run()
+        ids = [record["id"] for record in self.sim.infection_record]
+        
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), sum(person.infected for person in self.sim.workers + self.sim.patients))
+
+class TestFloor(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.sim = Simulation(max_timesteps=50, engine="vectorized", seed=0, wards=3, bays=2, beds=2, num_workers=10)
+    
+    def test_routes_go_through_the_main_corridor(self):
+        floor = self.sim.ward
+        for start_room in range(floor.outside_id):
+            for end_room in range(floor.corridor_id):
+                route = floor.plan_route(start_room, end_room)
+                rooms = [room for room, _, _ in route]
+                
+                # Path points are in the room of their leg, and routes only leave the patient's ward through the main corridor
+                self.assertTrue(all(floor.get_room_id(point) == room for room, leg_type, point in route if leg_type == PATH))
+                # Corridors are numbered in ward order after the bays, so the main corridor is never in the patient's ward
+                start_ward = floor.bay_wards[start_room] if start_room < floor.corridor_id else start_room - floor.corridor_id
+                self.assertEqual(floor.main_corridor_id in rooms, start_ward != floor.bay_wards[end_room])
+
+class TestEnsemble(unittest.TestCase):
+    def test_replicates_stop_once_everyone_is_infected(self):
+        sims = [Simulation(max_timesteps=3000, seed=seed) for seed in range(3)]
+        engine = VectorizedEngine(sims)
+        engine.run(3000, progress=False)
+        
+        for sim in sims:
+            ids = [record["id"] for record in sim.infection_record]
+            self.assertEqual(len(ids), len(set(ids)))
+            if sim.total_infected == sim.total_people:
+                self.assertEqual(len(ids), sim.total_people)
+        
+        self.assertEqual(list(engine.active), [sim.total_infected < sim.total_people for sim in sims])
+    
+    def test_replicates_match_separate_runs(self):
+        sims = [Simulation(max_timesteps=300, seed=seed) for seed in range(3)]
+        VectorizedEngine(sims).run(300, progress=False)
+        
+        for seed, sim in enumerate(sims):
+            separate_sim = Simulation(max_timesteps=300, engine="vectorized", seed=seed)
+            separate_sim.run(progress=False)
+            self.assertEqual(sim.infection_record, separate_sim.infection_record)
+    
+    def test_engines_agree_on_average(self):
+        # The engines use their random numbers differently, so only the mean number of infections at each timestep is compared, within 4 standard errors
+        timesteps = np.arange(300)
+        object_sims = [Simulation(max_timesteps=300, seed=seed) for seed in range(16)]
+        for sim in object_sims:
+            sim.run(progress=False)
+        vectorized_sims = [Simulation(max_timesteps=300, engine="vectorized", seed=seed) for seed in range(16)]
+        engine = VectorizedEngine(vectorized_sims)
+        engine.run(300, progress=False)
+        
+        object_counts, vectorized_counts = [np.array([np.searchsorted([record["timestep"] for record in sim.infection_record], timesteps, side="right") for sim in sims]) for sims in [object_sims, vectorized_sims]]
+        standard_error = np.sqrt(object_counts.var(axis=0) / len(object_sims) + vectorized_counts.var(axis=0) / len(vectorized_sims))
+        self.assertTrue(np.all(np.abs(object_counts.mean(axis=0) - vectorized_counts.mean(axis=0)) <= 4 * standard_error + 0.5))
+        
+        # Simultaneous infections are recorded in the same order, and the workers' patient lists are written back
+        engine.sync()
+        for sim in vectorized_sims:
+            types = [record["type"] for record in sim.infection_record]
+            self.assertEqual(types, [record_type for _, record_type in sorted(((record["timestep"], record["type"] == "worker"), record["type"]) for record in sim.infection_record)])
+            self.assertTrue(all(worker.patient_list[0] is worker.target_patient for worker in sim.workers))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import csv
+import json
+import time
+import numpy as np
+
+# Phases of a simulation timestep, in the order they run
+PHASES = ["emission", "exposure", "targets", "movement", "decay", "records"]
+
+# Opt-in timers and counters for a simulation run (see Simulation.run)
+# Each phase of a timestep is timed by a lap of a single clock, and counters are kept for worker moves, particles and collision queries
+# A per-timestep trace of the phase times and queue sizes is also kept if trace is set
+class Instrumentation:
+    def __init__(self, trace=False):
+        self.phase_times = dict.fromkeys(PHASES, 0.0)
+        self.counters = {}
+        self.particle_counters = {}
+        self.num_timesteps = 0
+        self.last_time = time.perf_counter()
+        
+        # Running totals and maximums of values sampled once per timestep (e.g. the number of particles in each queue)
+        self.sample_totals = {}
+        self.sample_maximums = {}
+        
+        self.trace = [] if trace else None
+        self.timestep_times = dict.fromkeys(PHASES, 0.0)
+    
+    # Start timing a timestep
+    def start(self):
+        self.last_time = time.perf_counter()
+    
+    # Add the time since the last lap (or start) to a phase
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phase_times[phase] += now - self.last_time
+        self.timestep_times[phase] += now - self.last_time
+        self.last_time = now
+    
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+    
+    # Counters for a particle manager, which it updates itself as particles are created and queried
+    def get_particle_counters(self, name, num_rooms):
+        if name not in self.particle_counters:
+            self.particle_counters[name] = ParticleCounters(num_rooms)
+        return self.particle_counters[name]
+    
+    # Finish a timestep, sampling values such as queue sizes
+    def end_timestep(self, timestep, **samples):
+        self.num_timesteps += 1
+        for name, value in samples.items():
+            self.sample_totals[name] = self.sample_totals.get(name, 0) + value
+            self.sample_maximums[name] = max(self.sample_maximums.get(name, value), value)
+        
+        if self.trace is not None:
+            self.trace.append({"timestep": timestep, **self.timestep_times, **samples})
+        self.timestep_times = dict.fromkeys(PHASES, 0.0)
+    
+    # Summary of the run: the total and mean time per timestep of each phase, the counters and the mean and maximum of each sample
+    def summary(self):
+        total_time = sum(self.phase_times.values())
+        num_timesteps = max(self.num_timesteps, 1)
+        return {
+            "timesteps": self.num_timesteps,
+            "total_time": total_time,
+            "phases": {phase: {
+                "total": phase_time,
+                "mean": phase_time / num_timesteps,
+                "fraction": phase_time / total_time if total_time > 0 else 0.0
+            } for phase, phase_time in self.phase_times.items()},
+            "counters": dict(self.counters),
+            "particles": {name: counters.summary() for name, counters in self.particle_counters.items()},
+            "samples": {name: {"mean": total / num_timesteps, "max": self.sample_maximums[name]} for name, total in self.sample_totals.items()}
+        }
+    
+    def save_summary(self, filename):
+        with open(filename, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+    
+    # Save the per-timestep trace as a csv file with one row per timestep
+    def save_trace(self, filename):
+        if self.trace is None:
+            raise ValueError("The trace was not kept, create the Instrumentation with trace=True")
+        
+        with open(filename, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(self.trace[0]) if len(self.trace) > 0 else ["timestep"] + PHASES)
+            writer.writeheader()
+            writer.writerows(self.trace)
+    
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{summary['timesteps']} timesteps in {summary['total_time']:.3f} s")
+        for phase, times in summary["phases"].items():
+            print(f"  {phase:<10} {times['total']:8.3f} s {times['fraction']:6.1%}")
+        for name, value in summary["counters"].items():
+            print(f"  {name}: {value}")
+        for name, counters in summary["particles"].items():
+            print(f"  {name} particles: {counters['emitted']} emitted, {counters['discarded']} discarded, {counters['candidates_per_query']:.1f} candidates per query")
+
+# Particle counters for one particle manager: particles emitted and discarded (landing outside the source's room) by room, and collision query candidates
+class ParticleCounters:
+    def __init__(self, num_rooms):
+        self.emitted = np.zeros(num_rooms, dtype=np.int64)
+        self.discarded = np.zeros(num_rooms, dtype=np.int64)
+        self.queries = 0
+        self.candidates = 0
+    
+    # Count particles emitted from sources in the given rooms, and whether each one was kept
+    def add_emitted(self, rooms, kept):
+        self.emitted += np.bincount(rooms, minlength=len(self.emitted))
+        self.discarded += np.bincount(np.asarray(rooms)[~np.asarray(kept, dtype=bool)], minlength=len(self.discarded))
+    
+    # Count collision queries and the candidate particles they checked the distance to
+    def add_queries(self, queries, candidates):
+        self.queries += int(queries)
+        self.candidates += int(candidates)
+    
+    def summary(self):
+        return {
+            "emitted": int(self.emitted.sum()),
+            "discarded": int(self.discarded.sum()),
+            "emitted_by_room": self.emitted.tolist(),
+            "discarded_by_room": self.discarded.tolist(),
+            "queries": self.queries,
+            "candidates": self.candidates,
+            "candidates_per_query": self.candidates / max(self.queries, 1)
+        }
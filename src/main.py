@@ -1,55 +1,204 @@
+import os
+import glob
+import json
 import numpy as np
 import matplotlib.pyplot as plt
-from sim import Simulation
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sim import Simulation, get_total_people
+from engine import VectorizedEngine
+from results import ResultsWriter, load_results, load_csv_rows, rows_to_sim_results
+from results import save_results as save_results_file
+from stats import EnsembleStatistics, get_infection_curves
 
-# Get simulation results and save to a csv file if required
-def get_simulation_results(masked=False, repeat_sims=25, save_results=False):
+# Parameters of every simulation run from here, which also size their statistics
+SIMULATION_PARAMETERS = {"max_timesteps": int((12*60*60)/10), "num_workers": 7, "wards": 1, "bays": 2, "beds": 3}
+
+# Run a single simulation with its own seed and return its infection record
+# If a checkpoint file is given the simulation is checkpointed as it runs and carries on from the checkpoint if there is one
+def run_simulation(masked, engine, seed_sequence, checkpoint_filename=None):
+    if checkpoint_filename is not None and os.path.exists(checkpoint_filename):
+        sim = Simulation.load_checkpoint(checkpoint_filename)
+    else:
+        sim = Simulation(masked=masked, engine=engine, seed=seed_sequence, **SIMULATION_PARAMETERS)
+    sim.run(progress=False, checkpoint_filename=checkpoint_filename)
+    
+    if checkpoint_filename is not None and os.path.exists(checkpoint_filename):
+        os.remove(checkpoint_filename)
+    return sim.infection_record
+
+# Checkpoint file of a simulation in a checkpoint directory (None if not checkpointing), named by the simulation's own seed so it is never taken for another simulation
+def get_checkpoint_filename(checkpoint_directory, seed_sequence):
+    if checkpoint_directory is None:
+        return None
+    return os.path.join(checkpoint_directory, f"simulation_{seed_sequence.entropy}_{'_'.join(str(key) for key in seed_sequence.spawn_key)}.pkl")
+
+# Run a chunk of simulations in one task, so short simulations are not dominated by inter-process communication
+def run_simulation_chunk(masked, engine, indexed_seeds, checkpoint_directory=None):
+    return [(i, run_simulation(masked, engine, seed_sequence, get_checkpoint_filename(checkpoint_directory, seed_sequence))) for i, seed_sequence in indexed_seeds]
+
+# Run a chunk of simulations in one task and return only their statistics, sized for max_timesteps timesteps and total_people people
+def run_simulation_chunk_statistics(masked, engine, indexed_seeds, max_timesteps, total_people):
+    statistics = EnsembleStatistics(max_timesteps, total_people)
+    statistics.add_batch([infection_record for _, infection_record in run_simulation_chunk(masked, engine, indexed_seeds)])
+    return statistics
+
+# Split the simulations into chunks, aiming for a few chunks per worker
+def split_into_chunks(indexed_seeds, workers, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = max(1, len(indexed_seeds) // (4 * workers))
+    return [indexed_seeds[i:i + chunk_size] for i in range(0, len(indexed_seeds), chunk_size)]
+
+# Yield (simulation index, infection record) pairs as the simulations finish, running them over a process pool if workers is set
+# Simulations in skip are not run, and simulations are checkpointed in checkpoint_directory if it is set
+def iter_simulation_results(masked=False, repeat_sims=25, engine="object", workers=None, seed=None, chunk_size=None, skip=(), checkpoint_directory=None):
+    # Each simulation gets its own seed from the master seed, so results do not depend on the number of workers or completion order
+    seed_sequences = np.random.SeedSequence(seed).spawn(repeat_sims)
+    indexed_seeds = [(i, seed_sequence) for i, seed_sequence in enumerate(seed_sequences) if i not in skip]
+    if len(indexed_seeds) == 0:
+        return
+    
+    if workers is None or workers <= 1:
+        for i, seed_sequence in indexed_seeds:
+            print(f"Running simulation {i+1} of {repeat_sims}")
+            yield i, run_simulation(masked, engine, seed_sequence, get_checkpoint_filename(checkpoint_directory, seed_sequence))
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_simulation_chunk, masked, engine, chunk, checkpoint_directory) for chunk in split_into_chunks(indexed_seeds, workers, chunk_size)]
+        for future in as_completed(futures):
+            for i, infection_record in future.result():
+                print(f"Completed simulation {i+1} of {repeat_sims}")
+                yield i, infection_record
+
+# What identifies the simulations saved in a results file, so a results file is only resumed by the same run
+def get_run_identity(masked, engine, repeat_sims, seed_sequence):
+    return {"masked": bool(masked), "engine": engine, "repeat_sims": int(repeat_sims), "entropy": seed_sequence.entropy}
+
+# File the identity of the run is saved in next to its results file
+def get_identity_filename(results_filename):
+    return os.path.splitext(results_filename)[0] + "_run.json"
+
+# Get simulation results and save them to a results file if required
+# When saving, simulations are checkpointed as they run, and if resume is set the simulations already in the results file are not run again,
+# so an interrupted call carries on where it stopped when it is repeated with the same arguments (and a fixed seed)
+# Otherwise the results file is overwritten, as are the checkpoints of any earlier run
+def get_simulation_results(masked=False, repeat_sims=25, save_results=False, engine="object", ensemble=False, workers=None, seed=None, chunk_size=None, results_filename="data/results.npy", resume=False):
     sim_results = []
     repeat_sims = repeat_sims # Number of simulations to run
-    for i in range(repeat_sims):
-        sim = Simulation(masked=masked)
-        print(f"Running simulation {i+1} of {repeat_sims}")
-        sim.run()
-        sim_results.append(sim.infection_record)
+    
+    # Advance all the simulations together in one vectorised ensemble, seeded the same way as when they are run separately
+    if ensemble:
+        sims = [Simulation(masked=masked, engine="vectorized", seed=seed_sequence, **SIMULATION_PARAMETERS) for seed_sequence in np.random.SeedSequence(seed).spawn(repeat_sims)]
+        print(f"Running {repeat_sims} simulations as an ensemble")
+        VectorizedEngine(sims).run(sims[0].max_timesteps, progress=False)
+        sim_results = [sim.infection_record for sim in sims]
+        if save_results:
+            save_results_file(results_filename, sim_results)
+            
+            # The results file was overwritten, so it no longer belongs to the run it was resumed by
+            if os.path.exists(get_identity_filename(results_filename)):
+                os.remove(get_identity_filename(results_filename))
+    
+    else:
+        # Put the results back in simulation order, whichever order they finish in, streaming each one to the results file as it finishes
+        sim_results = [None] * repeat_sims
+        
+        # The master seed is fixed here so the identity of the run matches the seeds it is run with, even if no seed is given
+        seed_sequence = np.random.SeedSequence(seed)
+        seed = seed_sequence.entropy
+        
+        writer = None
+        checkpoint_directory = None
+        completed = set()
+        if save_results:
+            identity = get_run_identity(masked, engine, repeat_sims, seed_sequence)
+            identity_filename = get_identity_filename(results_filename)
+            checkpoint_directory = os.path.splitext(results_filename)[0] + "_checkpoints"
+            resuming = resume and (os.path.exists(results_filename) or os.path.exists(identity_filename))
+            
+            # Only resume the results and checkpoints of the same run
+            if resuming:
+                saved_identity = None
+                if os.path.exists(identity_filename):
+                    with open(identity_filename, "r") as file:
+                        saved_identity = json.load(file)
+                if saved_identity != identity:
+                    raise ValueError(f"{results_filename} was not saved by a run with these arguments ({saved_identity} instead of {identity}), use resume=False to overwrite it")
+            
+            # Otherwise start again, removing the checkpoints of an earlier run
+            else:
+                for filename in glob.glob(os.path.join(checkpoint_directory, "simulation_*.pkl")):
+                    os.remove(filename)
+                with open(identity_filename, "w") as file:
+                    json.dump(identity, file)
+            
+            os.makedirs(checkpoint_directory, exist_ok=True)
+            writer = ResultsWriter(results_filename, append=resuming)
+            
+            # Take the simulations that have already finished from the results file
+            if writer.num_rows > 0:
+                rows = load_results(results_filename)[:writer.num_rows]
+                completed = set(np.unique(rows["simulation"]).tolist()) & set(range(repeat_sims))
+                for i, infection_record in enumerate(rows_to_sim_results(rows)):
+                    if i in completed:
+                        sim_results[i] = infection_record
+                print(f"Loaded {len(completed)} completed simulations from {results_filename}")
+        
+        try:
+            for i, infection_record in iter_simulation_results(masked, repeat_sims, engine, workers, seed, chunk_size, completed, checkpoint_directory):
+                sim_results[i] = infection_record
+                if writer is not None:
+                    writer.write(i, infection_record)
+        finally:
+            if writer is not None:
+                writer.close()
         
     print(f"Complete {repeat_sims} simulations")
     print(f"Average number of infections: {np.mean([len(sim_result) for sim_result in sim_results])}")
     
-    # Save the results to a csv file if required
-    if save_results:
-        with open("data/results.csv", "w") as file:
-            file.write("Simulation,Type,ID,Timestep\n")
-            for i, sim_result in enumerate(sim_results):
-                for record in sim_result:
-                    file.write(f"{i},{record['type']},{record['id']},{record['timestep']}\n")
-    
     return sim_results
                     
+# Get the statistics of many simulations without keeping their results, merging the statistics of each chunk if running over a process pool
+def get_simulation_statistics(masked=False, repeat_sims=25, engine="object", workers=None, seed=None, chunk_size=None):
+    max_timesteps = SIMULATION_PARAMETERS["max_timesteps"]
+    total_people = get_total_people(SIMULATION_PARAMETERS["wards"], SIMULATION_PARAMETERS["bays"], SIMULATION_PARAMETERS["beds"], SIMULATION_PARAMETERS["num_workers"])
+    statistics = EnsembleStatistics(max_timesteps, total_people)
+    seed_sequences = np.random.SeedSequence(seed).spawn(repeat_sims)
+    indexed_seeds = list(enumerate(seed_sequences))
+    
+    if workers is None or workers <= 1:
+        for i, seed_sequence in indexed_seeds:
+            print(f"Running simulation {i+1} of {repeat_sims}")
+            statistics.add(run_simulation(masked, engine, seed_sequence))
+    
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_simulation_chunk_statistics, masked, engine, chunk, max_timesteps, total_people) for chunk in split_into_chunks(indexed_seeds, workers, chunk_size)]
+            for future in as_completed(futures):
+                statistics.merge(future.result())
+                print(f"Completed {statistics.count} of {repeat_sims} simulations")
+    
+    print(f"Average time to infect everyone: {statistics.final_mean} +/- {statistics.final_std}")
+    return statistics
+
 # Plot simulation results
 def plot_simulation_results(sim_results, plot_average=False, plot_percentiles=False, plot_simulations=True):
     total_people = len(sim_results[0])
     
     # Plot the results for each simulation
     if plot_simulations:
-        for sim_result in sim_results:
+        for i, sim_result in enumerate(sim_results):
             x = [record["timestep"] for record in sim_result]
             y = [i / total_people * 100 for i in range(len(x))]
-            if sim_results.index(sim_result) == 0:
+            if i == 0:
                 plt.plot(x, y, '--', alpha=0.5, label="Simulation Result", color='red', zorder=1)
             else: 
                 plt.plot(x, y, '--', alpha=0.5, color='red', zorder=1)
         
     # Plot the average number of infections and percentiles for each timestep
     if plot_average or plot_percentiles:
-        timesteps = np.arange(0, np.max([record["timestep"] for sim_result in sim_results for record in sim_result]) + 1)
-        average_infections = np.empty(len(timesteps))
-        lower_percentile = np.empty(len(timesteps))
-        upper_percentile = np.empty(len(timesteps))
-        for timestep in timesteps:
-            infections_at_timestep = [np.interp(timestep, [record["timestep"] for record in sim_result], [i for i in range(len(sim_result))]) for sim_result in sim_results]
-            average_infections[timestep] = np.mean(infections_at_timestep)
-            lower_percentile[timestep] = np.percentile(infections_at_timestep, 15.87)
-            upper_percentile[timestep] = np.percentile(infections_at_timestep, 84.13)
+        average_infections, lower_percentile, upper_percentile, _ = get_average_and_percentiles(sim_results)
+        timesteps = np.arange(len(average_infections))
         
         if plot_percentiles:
             plt.fill_between(timesteps, lower_percentile / total_people * 100, upper_percentile / total_people * 100, alpha=0.3, color='red', label=r"1 $\sigma$ error on average", zorder=2)
@@ -66,35 +215,22 @@ def plot_simulation_results(sim_results, plot_average=False, plot_percentiles=Fa
     plt.savefig("plots/unmasked_25_results.pdf", format='pdf')
     plt.show()
 
-# Load results from a csv file
-def load_simulation_results(filename):
-    sim_results = []
-    with open(filename, "r") as file:
-        lines = file.readlines()
-        num_sims = int(lines[-1].split(",")[0]) + 1
-        #print(f"Number of simulations: {num_sims}")
-        
-        for i in range(num_sims):
-            sim_results.append([{
-                "type": line.split(",")[1],
-                "id": line.split(",")[2],
-                "timestep": int(line.split(",")[3])
-            } for line in lines if line.split(",")[0] == str(i)])
-
-    return sim_results
+# Load results from a results file (.npy) or a csv file, as a list of infection records per simulation
+def load_simulation_results(filename, chunk_size=65536):
+    if filename.endswith(".npy"):
+        return rows_to_sim_results(load_results(filename))
+    
+    # Parse the csv file in one pass (in chunks of rows) and group the rows by simulation
+    return rows_to_sim_results(load_csv_rows(filename, chunk_size))
 
 # Get average and percentiles for each timestep
 def get_average_and_percentiles(sim_results):
     total_people = len(sim_results[0])
     timesteps = np.arange(0, np.max([record["timestep"] for sim_result in sim_results for record in sim_result]) + 1)
-    average_infections = np.empty(len(timesteps))
-    lower_percentile = np.empty(len(timesteps))
-    upper_percentile = np.empty(len(timesteps))
-    for timestep in timesteps:
-        infections_at_timestep = [np.interp(timestep, [record["timestep"] for record in sim_result], [i for i in range(len(sim_result))]) for sim_result in sim_results]
-        average_infections[timestep] = np.mean(infections_at_timestep)
-        lower_percentile[timestep] = np.percentile(infections_at_timestep, 15.87)
-        upper_percentile[timestep] = np.percentile(infections_at_timestep, 84.13)
+    curves = get_infection_curves(sim_results, timesteps)
+    
+    average_infections = np.mean(curves, axis=0)
+    lower_percentile, upper_percentile = np.percentile(curves, [15.87, 84.13], axis=0)
     
     return average_infections, lower_percentile, upper_percentile, total_people
 
@@ -108,13 +244,13 @@ def main():
     
     # Load sim results
     if load_results:
-        sim_results = load_simulation_results("data/unmasked_25_results.csv")
+        sim_results = load_simulation_results("data/unmasked_25_results.npy")
     
     plot_simulation_results(sim_results, plot_average=False, plot_percentiles=False, plot_simulations=True)"""
     
     # Plot both masked and unmasked results
-    sim_results_masked = load_simulation_results("data/masked_25_results.csv")
-    sim_results_unmasked = load_simulation_results("data/unmasked_25_results.csv")
+    sim_results_masked = load_simulation_results("data/masked_25_results.npy")
+    sim_results_unmasked = load_simulation_results("data/unmasked_25_results.npy")
     
     # Get average and std for total time taken to infect everyone
     final_infections_masked = [sim_result[-1]["timestep"] for sim_result in sim_results_masked]
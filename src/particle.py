@@ -1,13 +1,15 @@
+import heapq
 import numpy as np
 import matplotlib.pyplot as plt
 
 # Define the COVID Particle class
 class Particle:
-    def __init__(self, creation_time, origin, spread=1, half_life=1, room=None):
+    def __init__(self, creation_time, origin, spread=1, half_life=1, room=None, rng=np.random):
         self.origin = origin
+        self.rng = rng
         
         # Set the particle's position
-        self.position = np.random.normal(self.origin, spread)
+        self.position = self.rng.normal(self.origin, spread)
         
         # Generate a time until the particle decays using half-life
         self.decay_time = self.generate_decay_time(half_life) + creation_time
@@ -19,7 +21,7 @@ class Particle:
         decay_rate = np.log(2) / half_life
         
         # Generate a random number between 0 and 1
-        random_number = np.random.uniform(0, 1)
+        random_number = self.rng.uniform(0, 1)
         
         # Calculate the decay time
         decay_time = -np.log(1 - random_number) / decay_rate
@@ -31,32 +33,46 @@ class Particle:
     
 # Particle manager class for one type of particle
 class ParticleManager:
-    def __init__(self, half_life, spread, mean_particles, ward):
-        self.particles = PriorityQueue()
+    def __init__(self, half_life, spread, mean_particles, ward, rng=None):
+        self.particles = DecayQueue()
         self.half_life = half_life
         self.spread = spread
         self.mean_particles = mean_particles
-        self.get_room = ward.get_room
+        self.get_room = ward.get_room_id
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.counters = None # ParticleCounters when the run is instrumented
     
     # Create particles for each source
     def create_particles(self, creation_time, origin, masked_reduction_particles=1, masked_reduction_spread=1):
-        num_particles = round(np.random.poisson(self.mean_particles) * masked_reduction_particles)
+        num_particles = round(self.rng.poisson(self.mean_particles) * masked_reduction_particles)
         origin_room = self.get_room(origin)
+        kept = [] if self.counters is not None else None # Only collected for the counters
         
         for i in range(num_particles):
             # Create the particle and add it to the queue if it is in the same room as the source
-            particle_to_add = Particle(creation_time, origin, self.spread * masked_reduction_spread, self.half_life, origin_room)
+            particle_to_add = Particle(creation_time, origin, self.spread * masked_reduction_spread, self.half_life, origin_room, self.rng)
             particle_room = self.get_room(particle_to_add.position)
+            if kept is not None:
+                kept.append(particle_room == origin_room)
             
             if particle_room == origin_room:
                 self.particles.push(particle_to_add, particle_to_add.decay_time)
+        
+        if self.counters is not None:
+            self.counters.add_emitted(np.full(num_particles, origin_room), kept)
+    
+    # Create particles for many sources, one source at a time
+    def create_particles_batch(self, creation_time, origins, masked_reduction_particles=1, masked_reduction_spread=1, groups=None, rngs=None):
+        # Particles are not grouped in this manager, so it only supports a single simulation
+        masked_reduction_particles = np.broadcast_to(masked_reduction_particles, len(origins))
+        masked_reduction_spread = np.broadcast_to(masked_reduction_spread, len(origins))
+        for origin, reduction_particles, reduction_spread in zip(origins, masked_reduction_particles, masked_reduction_spread):
+            self.create_particles(creation_time, origin, reduction_particles, reduction_spread)
     
     # Update the particles, checking for decay
     def update(self, timestep):
-        # Pop particles that have decayed
-        if len(self.particles.items) > 0:
-            while self.particles.priorities[0] <= timestep:
-                self.particles.pop()
+        # Pop every particle that has decayed by this timestep in one go
+        self.particles.pop_due(timestep)
             
     # Render the particles
     def render(self, ax, color='red'):
@@ -72,6 +88,8 @@ class ParticleManager:
         # Get the particles in the room
         position_room = self.get_room(position)
         room_particles = [p.position for p in self.particles.items if p.room == position_room]
+        if self.counters is not None:
+            self.counters.add_queries(1, len(room_particles))
         
         # Reject particles outside radius on x-axis
         min_x = position[0] - radius
@@ -93,38 +111,372 @@ class ParticleManager:
         # Return the particles within the radius
         return within_radius
     
+    # Count the particles within a radius of many positions, one position at a time
+    def count_particles(self, positions, radius, groups=None):
+        return np.array([len(self.check_for_particles(position, radius)) for position in positions], dtype=np.int64)
+    
+    # Positions of all the particles as an (N, 2) array
+    @property
+    def positions(self):
+        return np.array([p.position for p in self.particles.items]).reshape(-1, 2)
+    
+    # Number of particles in each room, indexed by room ID
+    def room_counts(self, num_rooms):
+        return np.bincount(np.array([p.room for p in self.particles.items], dtype=np.int64), minlength=num_rooms)
+    
+    def __len__(self):
+        return len(self.particles)
+    
+    
+# Particle manager backed by preallocated structure-of-arrays buffers instead of Particle objects
+class ArrayParticleManager:
+    def __init__(self, half_life, spread, mean_particles, ward, capacity=256, cell_size=0.2, rng=None):
+        self.half_life = half_life
+        self.spread = spread
+        self.mean_particles = mean_particles
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.ward = ward
+        self.counters = None # ParticleCounters when the run is instrumented
+        
+        # Particle buffers, only the first self.count entries are live
+        self.count = 0
+        self.x = np.empty(capacity)
+        self.y = np.empty(capacity)
+        self.decay_time = np.empty(capacity)
+        self.room = np.empty(capacity, dtype=np.int32) # Room ID of the ward
+        self.group = np.empty(capacity, dtype=np.int64) # Simulation each particle belongs to, so an ensemble can share one manager
+        
+        # Earliest decay time of the live particles, so timesteps with nothing to expire are skipped
+        self.next_decay = np.inf
+        
+        # Spatial index over the ward, with cells the size of a person's head radius
+        ward_bounds = (np.nanmin(ward.room_bounds[:, 0]), np.nanmin(ward.room_bounds[:, 1]), np.nanmax(ward.room_bounds[:, 2]), np.nanmax(ward.room_bounds[:, 3]))
+        self.grid = SpatialHashGrid(ward_bounds, cell_size)
+        
+    # Grow the buffers (doubling the capacity) so that extra particles fit
+    def reserve(self, extra):
+        required = self.count + extra
+        if required <= self.x.size:
+            return
+        
+        capacity = max(2 * self.x.size, required)
+        for name in ("x", "y", "decay_time", "room", "group"):
+            buffer = getattr(self, name)
+            grown = np.empty(capacity, dtype=buffer.dtype)
+            grown[:self.count] = buffer[:self.count]
+            setattr(self, name, grown)
+            
+    # Append a single particle to the buffers
+    def append(self, x, y, decay_time, room_id, group=0):
+        self.extend(np.array([x]), np.array([y]), np.array([decay_time]), np.array([room_id]), np.array([group]))
+        
+    # Append a batch of particles to the buffers
+    def extend(self, x, y, decay_time, room_id, group=0):
+        num_particles = len(x)
+        if num_particles == 0:
+            return
+        
+        self.reserve(num_particles)
+        end = self.count + num_particles
+        self.x[self.count:end] = x
+        self.y[self.count:end] = y
+        self.decay_time[self.count:end] = decay_time
+        self.room[self.count:end] = room_id
+        self.group[self.count:end] = group
+        self.grid.insert(x, y, np.arange(self.count, end), self.group[self.count:end])
+        self.count = end
+        self.next_decay = min(self.next_decay, np.min(decay_time))
+    
+    # Create particles for each source
+    def create_particles(self, creation_time, origin, masked_reduction_particles=1, masked_reduction_spread=1):
+        self.create_particles_batch(creation_time, np.array([origin]), masked_reduction_particles, masked_reduction_spread)
+        
+    # Draw the particles for a batch of sources from one generator, returning the source of each particle, its position and decay time
+    def draw_particles(self, rng, creation_time, origins, masked_reduction_particles, masked_reduction_spread):
+        # Number of particles for each source, and the source of each particle
+        num_particles = np.round(rng.poisson(self.mean_particles, len(origins)) * masked_reduction_particles).astype(int)
+        source = np.repeat(np.arange(len(origins)), num_particles)
+        
+        # Draw the positions and exponential decay times for the whole batch
+        spread = (self.spread * masked_reduction_spread)[source]
+        positions = rng.normal(origins[source], spread[:, None])
+        decay_times = creation_time + rng.exponential(self.half_life / np.log(2), len(source))
+        
+        return source, positions, decay_times
+        
+    # Create particles for many sources at once, drawing every position and decay time in single NumPy calls
+    # If a generator is given for each group the group's particles are drawn from it, so they do not depend on the other groups in the batch
+    def create_particles_batch(self, creation_time, origins, masked_reduction_particles=1, masked_reduction_spread=1, groups=0, rngs=None):
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        num_sources = len(origins)
+        if num_sources == 0:
+            return
+        
+        masked_reduction_particles = np.broadcast_to(masked_reduction_particles, num_sources)
+        masked_reduction_spread = np.broadcast_to(masked_reduction_spread, num_sources)
+        groups = np.broadcast_to(groups, num_sources)
+        
+        if rngs is None:
+            source, positions, decay_times = self.draw_particles(self.rng, creation_time, origins, masked_reduction_particles, masked_reduction_spread)
+        else:
+            batches = []
+            for group in np.unique(groups):
+                group_sources = np.flatnonzero(groups == group)
+                group_source, group_positions, group_decay_times = self.draw_particles(rngs[group], creation_time, origins[group_sources], masked_reduction_particles[group_sources], masked_reduction_spread[group_sources])
+                batches.append((group_sources[group_source], group_positions, group_decay_times))
+            source, positions, decay_times = (np.concatenate(parts) for parts in zip(*batches))
+        
+        # Only keep the particles that are in the same room as their source (sources outside the ward emit nothing)
+        source_rooms = self.ward.get_rooms(origins)
+        source_bounds = self.ward.room_bounds[source_rooms][source]
+        in_room = (positions[:, 0] >= source_bounds[:, 0]) & (positions[:, 0] <= source_bounds[:, 2]) & (positions[:, 1] >= source_bounds[:, 1]) & (positions[:, 1] <= source_bounds[:, 3])
+        if self.counters is not None:
+            self.counters.add_emitted(source_rooms[source], in_room)
+        
+        self.extend(positions[in_room, 0], positions[in_room, 1], decay_times[in_room], source_rooms[source[in_room]], groups[source[in_room]])
+    
+    # Update the particles, compacting the buffers to drop the ones that have decayed
+    def update(self, timestep):
+        if self.count == 0 or self.next_decay > timestep:
+            return
+        
+        keep = self.decay_time[:self.count] > timestep
+        remaining = np.count_nonzero(keep)
+        for buffer in (self.x, self.y, self.decay_time, self.room, self.group):
+            buffer[:remaining] = buffer[:self.count][keep]
+        self.grid.compact(keep)
+        self.count = remaining
+        self.next_decay = self.decay_time[:self.count].min() if self.count > 0 else np.inf
+        
+    # Render the particles
+    def render(self, ax, color='red'):
+        return ax.scatter(self.x[:self.count], self.y[:self.count], c=color, alpha=0.5, s=0.5, zorder=7)
+    
+    # Check for particles in a radius, only looking at the grid cells around the position
+    def check_for_particles(self, position, radius, group=0):
+        room_id = self.ward.get_room_id(position)
+        if room_id == self.ward.outside_id or self.count == 0:
+            return np.empty((0, 2))
+        
+        candidates = self.grid.query(position[0], position[1], radius, group)
+        if self.counters is not None:
+            self.counters.add_queries(1, len(candidates))
+        candidates = candidates[self.room[candidates] == room_id]
+        
+        dx = self.x[candidates] - position[0]
+        dy = self.y[candidates] - position[1]
+        within_radius = candidates[dx * dx + dy * dy <= radius * radius]
+        
+        return np.column_stack((self.x[within_radius], self.y[within_radius]))
     
-# Priority queue class
+    # Count the particles within a radius of many positions in one call, using a broadcast distance matrix for small problems and the grid otherwise
+    def count_particles(self, positions, radius, groups=0, broadcast_limit=65536):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        counts = np.zeros(len(positions), dtype=np.int64)
+        if self.count == 0 or len(positions) == 0:
+            return counts
+        
+        groups = np.broadcast_to(groups, len(positions))
+        position_rooms = self.ward.get_rooms(positions)
+        
+        if self.count * len(positions) <= broadcast_limit:
+            if self.counters is not None:
+                self.counters.add_queries(len(positions), self.count * len(positions))
+            dx = self.x[:self.count] - positions[:, 0, None]
+            dy = self.y[:self.count] - positions[:, 1, None]
+            within_radius = (dx * dx + dy * dy <= radius * radius) & (self.room[:self.count] == position_rooms[:, None]) & (self.group[:self.count] == groups[:, None])
+            return within_radius.sum(axis=1)
+        
+        # The grid keys include the group, so candidates are always from the same simulation
+        candidates, owners = self.grid.query_many(positions[:, 0], positions[:, 1], radius, groups)
+        if self.counters is not None:
+            self.counters.add_queries(len(positions), len(candidates))
+        dx = self.x[candidates] - positions[owners, 0]
+        dy = self.y[candidates] - positions[owners, 1]
+        within_radius = (dx * dx + dy * dy <= radius * radius) & (self.room[candidates] == position_rooms[owners])
+        return np.bincount(owners[within_radius], minlength=len(positions))
+    
+    # Positions of all the particles as an (N, 2) array
+    @property
+    def positions(self):
+        return np.column_stack((self.x[:self.count], self.y[:self.count]))
+    
+    # Number of particles in each room, indexed by room ID
+    def room_counts(self, num_rooms):
+        return np.bincount(self.room[:self.count], minlength=num_rooms)
+    
+    def __len__(self):
+        return self.count
+    
+    
+# Uniform grid spatial index over the ward, storing particle slots sorted by their cell key
+class SpatialHashGrid:
+    def __init__(self, bounds, cell_size=0.2):
+        self.x0, self.y0, x1, y1 = bounds
+        self.cell_size = cell_size
+        self.nx = int(np.ceil((x1 - self.x0) / cell_size)) + 1
+        self.ny = int(np.ceil((y1 - self.y0) / cell_size)) + 1
+        
+        # Cell key and buffer slot of each indexed particle, kept sorted by key
+        self.keys = np.empty(0, dtype=np.int64)
+        self.slots = np.empty(0, dtype=np.int64)
+        
+    # Get the cell coordinates of positions, clipped to the grid
+    def get_cells(self, x, y):
+        ix = np.clip(np.floor((np.asarray(x) - self.x0) / self.cell_size).astype(np.int64), 0, self.nx - 1)
+        iy = np.clip(np.floor((np.asarray(y) - self.y0) / self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return ix, iy
+    
+    # Get the (row-major) cell keys of positions, with each group of particles having its own copy of the grid
+    def get_keys(self, x, y, groups=0):
+        ix, iy = self.get_cells(x, y)
+        return np.asarray(groups, dtype=np.int64) * (self.nx * self.ny) + iy * self.nx + ix
+        
+    # Merge a batch of new particles into the sorted index
+    def insert(self, x, y, slots, groups=0):
+        keys = self.get_keys(x, y, groups)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        
+        insert_at = np.searchsorted(self.keys, keys, side="right")
+        self.keys = np.insert(self.keys, insert_at, keys)
+        self.slots = np.insert(self.slots, insert_at, np.asarray(slots, dtype=np.int64)[order])
+        
+    # Drop the particles whose slots are not kept and renumber the rest to match the compacted buffers
+    def compact(self, keep):
+        new_slots = np.cumsum(keep) - 1
+        survive = keep[self.slots]
+        self.keys = self.keys[survive]
+        self.slots = new_slots[self.slots[survive]]
+        
+    # Get the slots of the particles in the cells overlapping the square around a position
+    def query(self, x, y, radius, group=0):
+        (ix0, ix1), (iy0, iy1) = self.get_cells([x - radius, x + radius], [y - radius, y + radius])
+        
+        # Cells in a row are consecutive keys, so each row of cells is one contiguous range of the index
+        rows = group * (self.nx * self.ny) + np.arange(iy0, iy1 + 1) * self.nx
+        starts = np.searchsorted(self.keys, rows + ix0, side="left")
+        ends = np.searchsorted(self.keys, rows + ix1, side="right")
+        
+        if len(starts) == 1:
+            return self.slots[starts[0]:ends[0]]
+        return np.concatenate([self.slots[start:end] for start, end in zip(starts, ends)])
+    
+    # Get the candidate slots around many positions at once, along with the index of the position each candidate belongs to
+    def query_many(self, x, y, radius, groups=0):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        group_offsets = np.broadcast_to(np.asarray(groups, dtype=np.int64) * (self.nx * self.ny), x.shape)
+        ix0, iy0 = self.get_cells(x - radius, y - radius)
+        ix1, iy1 = self.get_cells(x + radius, y + radius)
+        
+        # One contiguous index range per row of cells for every position, rows past the top of the square are left empty
+        max_rows = int(np.max(iy1 - iy0)) + 1 if len(x) > 0 else 0
+        rows = iy0[:, None] + np.arange(max_rows)
+        row_keys = group_offsets[:, None] + rows * self.nx
+        starts = np.searchsorted(self.keys, row_keys + ix0[:, None], side="left")
+        ends = np.searchsorted(self.keys, row_keys + ix1[:, None], side="right")
+        ends = np.where(rows <= iy1[:, None], ends, starts)
+        
+        # Flatten all the ranges into one array of index positions
+        starts = starts.ravel()
+        lengths = (ends.ravel() - starts)
+        total = int(lengths.sum())
+        range_offsets = np.cumsum(lengths) - lengths
+        index_positions = np.arange(total) - np.repeat(range_offsets - starts, lengths)
+        owners = np.repeat(np.repeat(np.arange(len(x)), max_rows), lengths)
+        
+        return self.slots[index_positions], owners
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    
+# Priority queue class, implemented as a binary heap so push and pop are O(log n)
 class PriorityQueue: 
     def __init__(self):
-        self.items = np.array([])
-        self.priorities = np.array([])
+        self.heap = []
+        self.counter = 0 # Tie-breaker so items with equal priorities pop in insertion order
         
     # Push an item onto the queue with a given priority
     def push(self, item, priority):
-        # If the queue is empty, initialise the items and priorities arrays with the new item and its priority
-        if self.items.size == 0:
-            self.items = np.array([item])
-            self.priorities = np.array([priority])
-        else:
-            # Find the indices of the items with a higher priority than the new item
-            higher_priority_indices = np.argwhere(self.priorities > priority)
-            
-            # If there are no items with a higher priority, append the new item at the end
-            if higher_priority_indices.size == 0:
-                index_to_push = self.items.size
-            else:
-                # Otherwise, insert the new item at the position of the first item with a higher priority
-                index_to_push = higher_priority_indices[0]
-            
-            # Insert the new item and its priority at the calculated index
-            self.items = np.insert(self.items, index_to_push, item, axis=0)
-            self.priorities = np.insert(self.priorities, index_to_push, priority)
+        heapq.heappush(self.heap, (priority, self.counter, item))
+        self.counter += 1
         
     # Pop the first item from the queue
     def pop(self):
-        self.items = self.items[1:]
-        self.priorities = self.priorities[1:]
+        return heapq.heappop(self.heap)[2]
+    
+    # Items and priorities in priority order (sorted copies, intended for inspection rather than the hot path)
+    @property
+    def items(self):
+        return np.array([entry[2] for entry in sorted(self.heap)])
+    
+    @property
+    def priorities(self):
+        return np.array([entry[0] for entry in sorted(self.heap)])
+    
+    def __len__(self):
+        return len(self.heap)
+    
+    
+# Decay queue class, a ring of integer timestep buckets as decay is only checked at whole timesteps
+class DecayQueue:
+    def __init__(self, horizon=64):
+        self.horizon = horizon # Number of timesteps covered by the ring
+        self.buckets = [[] for _ in range(self.horizon)]
+        self.overflow = [] # Heap of items due beyond the ring horizon
+        self.counter = 0
+        self.current_step = 0 # Earliest timestep that has not been expired yet
+        self.size = 0
+        
+    # Push an item that decays at the given time, it is expired at the first whole timestep at or after it
+    def push(self, item, priority):
+        due_step = max(int(np.ceil(priority)), self.current_step)
+        if due_step < self.current_step + self.horizon:
+            self.buckets[due_step % self.horizon].append(item)
+        else:
+            heapq.heappush(self.overflow, (due_step, self.counter, item))
+            self.counter += 1
+        self.size += 1
+        
+    # Remove and return every item due at or before the timestep
+    def pop_due(self, timestep):
+        expired = []
+        
+        # Nothing to expire, so jump straight to the next timestep
+        if self.size == 0:
+            self.current_step = max(self.current_step, int(timestep) + 1)
+            return expired
+        
+        while self.current_step <= timestep and self.size > 0:
+            # Move overflow items into the ring once they fall within the horizon
+            while self.overflow and self.overflow[0][0] < self.current_step + self.horizon:
+                due_step, _, item = heapq.heappop(self.overflow)
+                self.buckets[due_step % self.horizon].append(item)
+            
+            # Expire the whole bucket at once
+            bucket_index = self.current_step % self.horizon
+            expired.extend(self.buckets[bucket_index])
+            self.size -= len(self.buckets[bucket_index])
+            self.buckets[bucket_index] = []
+            self.current_step += 1
+            
+        self.current_step = max(self.current_step, int(timestep) + 1)
+        return expired
+    
+    # All items currently in the queue (in no particular order)
+    @property
+    def items(self):
+        items = [item for bucket in self.buckets for item in bucket]
+        items.extend(entry[2] for entry in self.overflow)
+        return items
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        return iter(self.items)
         
     
     
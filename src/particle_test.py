@@ -1,6 +1,7 @@
 import unittest
 import numpy as np
-from particle import PriorityQueue
+from particle import PriorityQueue, DecayQueue, ArrayParticleManager
+from ward import Ward
 
 class TestPriorityQueue(unittest.TestCase):
     def setUp(self):
@@ -27,5 +28,81 @@ class TestPriorityQueue(unittest.TestCase):
         self.assertEqual(self.pq.priorities[0], 2)
         self.assertEqual(self.pq.priorities[1], 3)
 
+class TestDecayQueue(unittest.TestCase):
+    def setUp(self):
+        self.dq = DecayQueue(horizon=4)
+
+    def test_pop_due_expires_whole_timesteps(self):
+        self.dq.push('item1', 0.5)
+        self.dq.push('item2', 1.0)
+        self.dq.push('item3', 1.2)
+        self.dq.push('item4', 10.7) # Beyond the horizon, held in the overflow heap
+        
+        self.assertEqual(len(self.dq), 4)
+        self.assertEqual(self.dq.pop_due(0), [])
+        self.assertEqual(sorted(self.dq.pop_due(1)), ['item1', 'item2'])
+        self.assertEqual(self.dq.pop_due(2), ['item3'])
+        self.assertEqual(self.dq.pop_due(10), [])
+        self.assertEqual(self.dq.pop_due(11), ['item4'])
+        self.assertEqual(len(self.dq), 0)
+        
+    def test_push_in_the_past_expires_next(self):
+        self.dq.pop_due(5)
+        self.dq.push('item1', 2.0)
+        
+        self.assertEqual(self.dq.pop_due(6), ['item1'])
+
+class TestArrayParticleManager(unittest.TestCase):
+    def setUp(self):
+        self.ward = Ward(bays=2, beds=3, bay_length=12, bay_width=8, corridor_width=4)
+        self.manager = ArrayParticleManager(half_life=1, spread=1, mean_particles=8, ward=self.ward, capacity=2)
+        
+    def test_buffers_grow_and_compact(self):
+        room_id = self.ward.corridor_id
+        for i in range(5):
+            self.manager.append(0.0, 1.0 + i, i + 0.5, room_id)
+        
+        self.assertEqual(len(self.manager), 5)
+        self.assertGreaterEqual(self.manager.x.size, 5)
+        
+        self.manager.update(2)
+        
+        self.assertEqual(len(self.manager), 3)
+        np.testing.assert_array_equal(self.manager.decay_time[:3], [2.5, 3.5, 4.5])
+        self.assertEqual(self.manager.next_decay, 2.5)
+        
+    def test_check_for_particles(self):
+        room_id = self.ward.corridor_id
+        self.manager.append(0.0, 4.0, 10, room_id)
+        self.manager.append(0.1, 4.1, 10, room_id)
+        self.manager.append(1.0, 4.0, 10, room_id)
+        
+        self.assertEqual(len(self.manager.check_for_particles(np.array([0.0, 4.0]), 0.2)), 2)
+        
+    def test_grid_query_matches_brute_force(self):
+        np.random.seed(0)
+        for timestep in range(5):
+            self.manager.create_particles_batch(timestep, np.array([[0.0, 4.0], [-8.0, 3.0], [9.0, 12.0]]))
+            self.manager.update(timestep)
+            
+        for position in np.random.uniform([-14, 0], [14, 16], (50, 2)):
+            room_id = self.ward.get_room_id(position)
+            x = self.manager.x[:len(self.manager)]
+            y = self.manager.y[:len(self.manager)]
+            expected = (self.manager.room[:len(self.manager)] == room_id) & ((x - position[0]) ** 2 + (y - position[1]) ** 2 <= 0.5 ** 2)
+            
+            self.assertEqual(len(self.manager.check_for_particles(position, 0.5)), np.count_nonzero(expected))
+            
+    def test_count_particles_kernels_agree(self):
+        np.random.seed(1)
+        for timestep in range(5):
+            self.manager.create_particles_batch(timestep, np.array([[0.0, 4.0], [-8.0, 3.0], [9.0, 12.0]]))
+            
+        positions = np.random.normal([0.0, 4.0], 1.0, (40, 2))
+        expected = [len(self.manager.check_for_particles(position, 0.3)) for position in positions]
+        
+        np.testing.assert_array_equal(self.manager.count_particles(positions, 0.3), expected)
+        np.testing.assert_array_equal(self.manager.count_particles(positions, 0.3, broadcast_limit=0), expected)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,86 +1,110 @@
 import numpy as np
-from numpy.random import shuffle
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib.patches import Circle
+from ward import PATH, PATIENT
+
+# Infection and mask parameters, shared by everyone instead of being copied into each person
+class PersonParameters:
+    __slots__ = ("innate_immunity", "mask_efficiency", "vaccine_efficiency", "masked_airborne_reduction_spread", "masked_airborne_reduction_particles")
+    
+    def __init__(self, innate_immunity=0.55, mask_efficiency=0.6, vaccine_efficiency=0.8, masked_airborne_reduction_spread=0.25, masked_airborne_reduction_particles=(1 - 0.6)):
+        self.innate_immunity = innate_immunity
+        self.mask_efficiency = mask_efficiency
+        self.vaccine_efficiency = vaccine_efficiency
+        self.masked_airborne_reduction_spread = masked_airborne_reduction_spread
+        self.masked_airborne_reduction_particles = masked_airborne_reduction_particles
+        
+DEFAULT_PARAMETERS = PersonParameters()
+
+# Fixed size ring buffer of the most recent positions
+class TrajectoryBuffer:
+    __slots__ = ("buffer", "count")
+    
+    def __init__(self, length):
+        self.buffer = np.empty((length, 2))
+        self.count = 0
+        
+    def append(self, position):
+        self.buffer[self.count % len(self.buffer)] = position
+        self.count += 1
+        
+    # The stored positions, oldest first
+    @property
+    def positions(self):
+        if self.count <= len(self.buffer):
+            return self.buffer[:self.count].copy()
+        return np.roll(self.buffer, -(self.count % len(self.buffer)), axis=0)
+    
+    def __len__(self):
+        return min(self.count, len(self.buffer))
 
 # Define the Person class
 class Person:
-    def __init__(self, position=np.array([0.0,0.0]), infected=False, masked=False, vaccinated=False):
+    __slots__ = ("rng", "position", "infected", "masked", "vaccinated", "parameters", "id")
+    
+    def __init__(self, position=np.array([0.0,0.0]), infected=False, masked=False, vaccinated=False, rng=None, parameters=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.position = position
         self.infected = infected
         self.masked = masked
-        self.mask_efficiency = 0.6 if self.masked else 1.0
         self.vaccinated = vaccinated
-        self.vaccine_efficiency = 0.8 if self.vaccinated else 1.0
-        self.innate_immunity = 0.55
-        
-        # Set the infection probability: innate_immunity * mask_efficiency * vaccine_efficiency
-        self.infection_probability = self.innate_immunity * self.mask_efficiency * self.vaccine_efficiency
-        
-        self.masked_airborne_reduction_spread = 0.25
-        self.masked_airborne_reduction_particles = (1 - 0.6)
+        self.parameters = parameters if parameters is not None else DEFAULT_PARAMETERS
         
         # Set ID for person (random hex string)
-        self.id = np.random.bytes(4).hex()
+        self.id = self.rng.bytes(4).hex()
         
+    # Parameters are looked up from the shared parameters
+    @property
+    def innate_immunity(self):
+        return self.parameters.innate_immunity
     
-    def update(self, frame, airborne_particles, surface_particles, ward):
-        # Check if the person has been infected, if so create new particles
-        if self.infected:
-            # Masks reduce the spread and number of airborne particles plus eliminates surface particles
-            if self.masked:
-                airborne_particles.create_particles(frame, self.position, masked_reduction_particles=self.masked_airborne_reduction_particles, masked_reduction_spread=self.masked_airborne_reduction_spread)
-            
-            # Non-masked individuals create the normal number of particles
-            else:
-                airborne_particles.create_particles(frame, self.position)
-                surface_particles.create_particles(frame, self.position)
-            
-        # Check for particle collisions if the person is not infected
-        else:
-            # Get the number of particles that have collided with the person, 0.2 is the radius of the person's head
-            airborne_particle_collisions = airborne_particles.check_for_particles(self.position, 0.2)
-            surface_particle_collisions = surface_particles.check_for_particles(self.position, 0.2)
-            total_collisions = len(airborne_particle_collisions) + len(surface_particle_collisions)
-            
-            # If there are collisions, check if the person has been infected
-            if total_collisions > 0:
-                # Calculate acceptance probability
-                acceptance_probability = 1 - (1 - self.infection_probability) ** total_collisions
-                
-                # Accept or reject the infection
-                random_value = np.random.uniform(0, 1)
-                if random_value < acceptance_probability:
-                    self.infected = True
-                    #print(f"Person has been infected with probability {acceptance_probability} and {total_collisions} collisions")
-                    
-                
-            
-            
-        
+    @property
+    def mask_efficiency(self):
+        return self.parameters.mask_efficiency if self.masked else 1.0
+    
+    @property
+    def vaccine_efficiency(self):
+        return self.parameters.vaccine_efficiency if self.vaccinated else 1.0
+    
+    # The infection probability: innate_immunity * mask_efficiency * vaccine_efficiency
+    # It is worked out when it is used, as masks and vaccinations are given out after the person is created
+    @property
+    def infection_probability(self):
+        return self.innate_immunity * self.mask_efficiency * self.vaccine_efficiency
+    
+    @property
+    def masked_airborne_reduction_spread(self):
+        return self.parameters.masked_airborne_reduction_spread
+    
+    @property
+    def masked_airborne_reduction_particles(self):
+        return self.parameters.masked_airborne_reduction_particles
     
     def render(self, ax):
         pass
         
 # Define healthcare worker class (which inherits from Person)
 class Worker(Person):
-    def __init__(self, patient_list, ward, position=np.array([0.0,0.0]), step_length=0.1):
-        super().__init__(position)
-        self.type = "worker"
+    __slots__ = ("patient_list", "step_length", "direction", "trajectory", "target_patient", "route", "route_cursor")
+    type = "worker"
+    
+    def __init__(self, patient_list, ward, position=np.array([0.0,0.0]), step_length=0.1, rng=None, parameters=None, history_length=0):
+        super().__init__(position, rng=rng, parameters=parameters)
         self.patient_list = patient_list
-        shuffle(self.patient_list)
+        self.rng.shuffle(self.patient_list)
         self.step_length = step_length
-        direction = np.random.uniform(-1, 1, 2)
+        direction = self.rng.uniform(-1, 1, 2)
         self.direction = direction / np.linalg.norm(direction)
-        self.previous_positions = [self.position.copy()]
         
-        # Set the target patient and path
-        self.target_patient = self.patient_list[0]
-        self.path = self.get_path(self.position, self.target_patient, ward) # A list of targets
+        # Keep the last history_length positions if required
+        self.trajectory = TrajectoryBuffer(history_length) if history_length > 0 else None
+        if self.trajectory is not None:
+            self.trajectory.append(self.position)
         
-        # Find the first target on the path where type is not "room"
-        self.target = [p for p in self.path if p.type != "room"][0]
+        # Set the target patient and the route to them
+        self.target_patient = self.patient_list[0]
+        self.set_route(ward)
         
     def render(self, ax):
         facecolor = 'cyan'
@@ -88,15 +112,14 @@ class Worker(Person):
         circle = Circle((self.position[0], self.position[1]), 0.5, facecolor=facecolor, edgecolor=edgecolor, zorder=10)
         return ax.add_patch(circle)
         
-    # Move the worker towards the patient
-    def update(self, frame, airborne_particles, surface_particles, ward):
-        # Call the parent class's update method
-        super().update(frame, airborne_particles, surface_particles, ward)
-        
-        target_position = self.target.position
+    # Retarget the worker if it has reached its patient or a point on its path, returning the target position
+    def update_target(self, ward):
+        target_type = ward.route_types[self.route][self.route_cursor]
+        target_position = self.get_target_position(ward)
+        reached = np.linalg.norm(self.position - target_position) < self.step_length
         
         # Check if the worker has reached the patient
-        if self.target.type == "patient" and np.linalg.norm(self.position - self.target.position) < self.step_length:
+        if target_type == PATIENT and reached:
             #print("Worker has reached the patient")
             
             # Roll the patient list
@@ -104,34 +127,59 @@ class Worker(Person):
             
             # Set the new target
             self.target_patient = self.patient_list[0]
-            self.path = self.get_path(self.position, self.target_patient, ward)
-            self.target = [p for p in self.path if p.type != "room"][0]
-            target_position = self.target.position
+            self.set_route(ward)
         
         # Check if the worker has reached a point on its path
-        elif self.target.type == "path" and np.linalg.norm(self.position - self.target.position) < self.step_length:
+        elif target_type == PATH and reached:
             #print("Worker has reached a point on its path")
             
             # Set the new target
-            self.target = [p for p in self.path[self.path.index(self.target) + 1:] if p.type != "room"][0]
-            target_position = self.target.position
-        
-        # Move the worker
-        self.move(target_position, ward)
+            self.route_cursor = ward.route_next_targets[self.route][self.route_cursor + 1]
         
-    # Try to move the worker in the direction of the target
-    def move(self, target_position, ward):
+        return self.get_target_position(ward)
+    
+    # Look up the route from the worker's current room to the target patient's bay in the ward's routing table, and target its first point
+    def set_route(self, ward):
+        self.route = (ward.get_room_id(self.position), ward.get_room_id(self.target_patient.position))
+        self.route_cursor = ward.route_next_targets[self.route][0]
+    
+    # Get the position of the worker's current target
+    def get_target_position(self, ward):
+        if ward.route_types[self.route][self.route_cursor] == PATIENT:
+            return self.target_patient.position
+        return ward.route_points[self.route][self.route_cursor]
+        
+    # Propose new directions for a list of workers at once, sampled directly from the directions that keep each worker in its current room or move it into the next room on its path
+    # Returns a (proposed direction, acceptance random value, whether the current direction is a valid move, whether the proposed direction is a valid move) tuple per worker
+    @staticmethod
+    def propose_moves(workers, ward):
+        positions = np.array([worker.position for worker in workers], dtype=float)
+        routes = np.array([worker.route for worker in workers])
+        allowed_rooms = ward.get_allowed_rooms(routes[:, 0], routes[:, 1], ward.get_rooms(positions))
+        step_arcs = ward.get_step_arcs(positions, [worker.step_length for worker in workers], allowed_rooms)
+        
+        # Each worker draws two random numbers from its own generator, one for the direction and one to accept it
+        random_values = np.array([worker.rng.uniform(0, 1, 2) for worker in workers])
+        proposed_directions = ward.sample_step_directions(*step_arcs, random_values[:, 0])
+        current_directions = np.array([worker.direction for worker in workers], dtype=float)
+        current_open = ward.is_step_open(*step_arcs, current_directions)
+        
+        # Workers with nowhere to go keep their current direction, which is blocked too
+        stuck = np.isnan(proposed_directions[:, 0])
+        proposed_directions[stuck] = current_directions[stuck]
+        
+        return list(zip(proposed_directions, random_values[:, 1], current_open, ~stuck))
+        
+    # Try to move the worker in the direction of the target, using a proposal from propose_moves if one is given
+    # Returns whether the proposed direction was accepted and whether the worker moved
+    def move(self, target_position, ward, proposal=None):
         # Calculate the direction to the patient
         direction_to_target = target_position - self.position
         
-        # Propose a new direction that is within the ward and ensure the worker will make a valid move (if accepted)
-        while True:
-            proposed_direction = np.random.uniform(-1, 1, 2)
-            proposed_direction /= np.linalg.norm(proposed_direction)
-            new_position = self.position + self.step_length * proposed_direction
-
-            if self.check_move(self.position, new_position, ward):
-                break
+        # Propose a new direction that is a valid move
+        if proposal is None:
+            proposal = Worker.propose_moves([self], ward)[0]
+        proposed_direction, random_value, current_open, proposed_open = proposal
         
         # Calculate angle between proposed direction and direction to patient
         angle = np.arccos(np.dot(direction_to_target, proposed_direction) / (np.linalg.norm(direction_to_target) * np.linalg.norm(proposed_direction)))
@@ -140,135 +188,50 @@ class Worker(Person):
         # Calculate acceptance probability
         acceptance_probability = (np.pi - angle) / (np.pi)
         
-        # Accept or reject the new direction
-        random_value = np.random.uniform(0, 1)
-        if random_value < acceptance_probability:
+        # Accept or reject the new direction, a proposed direction is a valid move unless the worker is stuck
+        accepted = random_value < acceptance_probability
+        if accepted:
             self.direction = proposed_direction
             
         # Move the worker if the new direction is valid
-        if self.check_move(self.position, self.position + self.step_length * self.direction, ward):
+        moving = proposed_open if accepted else current_open
+        if moving:
             
             # Update the worker's position
             previous_position = self.position.copy()
             self.position += self.step_length * self.direction
             
             # If the worker has accidentally moved into its next room but hasn't fulfilled the path, update the target to be the one of the current room or next available target
-            current_room = ward.get_room(self.position)
-            previous_room = ward.get_room(previous_position)
+            current_room = ward.get_room_id(self.position)
+            previous_room = ward.get_room_id(previous_position)
             
             # Check if the worker has moved into a new room
             if current_room != previous_room:
-                # Get the list of paths that have target positions
-                path_targets = [p for p in self.path if p.type != "room"]
-                if self.target.room != current_room and self.target.room == previous_room:
+                target_room = ward.route_rooms[self.route][self.route_cursor]
+                if target_room != current_room and target_room == previous_room:
                     # Move onto the next target (where it is not of type "room")
-                    self.target = [p for p in self.path[self.path.index(self.target) + 1:] if p.type != "room"][0]
+                    self.route_cursor = ward.route_next_targets[self.route][self.route_cursor + 1]
                 
         #self.position += self.step_length * self.direction
         
-        # Add the new position to the list of previous positions
-        self.previous_positions.append(self.position.copy())
-        
-    # Check if the worker will make a valid move
-    def check_move(self, position, proposed_position, ward):
-        #print(f"Checking move from {position} to {proposed_position}")
-        current_room = ward.get_room(position)
-        proposed_room = ward.get_room(proposed_position)
-        
-        
-        #print(f"Current Room: {current_room}")
-        #print(f"Proposed Room: {proposed_room}")
-        
-        # Check if the worker is moving inside the same room
-        if current_room == proposed_room:
-            #print(f"Worker is moving inside {current_room} - accepting move")
-            return True
-        
-        # Get worker's path rooms
-        path_rooms = [p.room for p in self.path]
-        
-        # Get the current and next room (if it exists)
-        #current_room_index = path_rooms.index(current_room)
-        current_room_index = len(path_rooms) - 1 - path_rooms[::-1].index(current_room) # Find the last index of the current room by reversing the list
-        possible_rooms = path_rooms[current_room_index:current_room_index + 2]
-        #print(f"Possible rooms: {possible_rooms}")
-        
-        # Check if the worker is moving into one of those rooms
-        if proposed_room in possible_rooms:
-            #print(f"Worker is moving into {proposed_room} - accepting move")
-            return True
-        
-        
-    # Get the path to the next patient
-    def get_path(self, position, target_patient, ward):
-        path = []
-        
-        # Get the worker's bay
-        worker_bay = ward.get_room(position)
-        if worker_bay != "Corridor":
-            worker_bay = int(worker_bay.split(" ")[1])
-            
-        # Get the target patient's bay
-        patient_bay = ward.get_room(target_patient.position)
-        patient_bay = int(patient_bay.split(" ")[1])
-        
-        # Check if the worker is in the same room as the target patient
-        if ward.get_room(position) == ward.get_room(target_patient.position):
-            path.append(Path(target_patient.position, ward.get_room(target_patient.position), type="patient"))
-            return path
-        
-        
-        # If not, find the path to the target patient
-        
-        # Get spine points of the ward
-        spine_points = ward.ward_spine
-        
-        # Add the worker's current room to the path
-        path.append(Path(None, ward.get_room(position), type="room"))
-        
-        # Find the spine point for the target patient's bay
-        patient_spine = spine_points[(patient_bay - 1) // 2]
-        
-        # If the worker is not in the corridor, find the bay
-        if not worker_bay == "Corridor":
-            # Find the spine point for the worker's current bay
-            """if worker_bay % 2 == 0:
-                worker_spine = spine_points[worker_bay // 2]
-            else:
-                worker_spine = spine_points[worker_bay // 2 + 1]"""
-            worker_spine = spine_points[(worker_bay - 1) // 2]
-            
-            # If the worker's bay and the target's bay are directly opposite each other
-            #if worker_spine == patient_spine:
-            if worker_spine[0] == patient_spine[0] and worker_spine[1] == patient_spine[1]:
-                #print("Worker and patient are directly opposite each other")
-                path.append(Path(None, "Corridor", type="room"))
-                path.append(Path(target_patient.position, ward.get_room(target_patient.position), type="patient"))
-                return path
-            
-            # Else, the worker must move through the spine points
-            path.append(Path(worker_spine, "Corridor", type="path"))
-        
-        # Add the target patient's spine point and position to the path
-        path.append(Path(patient_spine, "Corridor", type="path"))
-        path.append(Path(target_patient.position, ward.get_room(target_patient.position), type="patient"))
-            
-        #print(f"Path: {path}")
-        #print(f"Path rooms: {[p.room for p in path]}")
-        
-        return path
-        
+        # Add the new position to the trajectory
+        if self.trajectory is not None:
+            self.trajectory.append(self.position)
         
+        return accepted, moving
         
+    # Previous positions, oldest first (empty if no history is kept)
+    @property
+    def previous_positions(self):
+        return self.trajectory.positions if self.trajectory is not None else np.empty((0, 2))
         
 # Define patient class (which inherits from Person)
 class Patient(Person):
-    def __init__(self, position=np.array([0.0,0.0])):
-        super().__init__(position)
-        self.type = "patient"
+    __slots__ = ()
+    type = "patient"
     
-    def update(self, frame, airborne_particles, surface_particles, ward):
-        super().update(frame, airborne_particles, surface_particles, ward)
+    def __init__(self, position=np.array([0.0,0.0]), rng=None, parameters=None):
+        super().__init__(position, rng=rng, parameters=parameters)
     
     # Render the patient
     def render(self, ax):
@@ -280,13 +243,6 @@ class Patient(Person):
         circle = Circle((self.position[0], self.position[1]), 0.5, facecolor=facecolor, edgecolor=edgecolor, zorder=9)
         ax.add_patch(circle)
         
-class Path:
-    def __init__(self, position, room, type="path"):
-        self.position = position
-        self.room = room
-        self.type = type
-        
-        
 def main():
     # Create a list of patients with random positions in a -10 to 10 square
     bounds = np.array([[-10, 10], [-10, 10]])
@@ -306,7 +262,7 @@ def main():
     sc2 = ax.scatter(worker.position[0], worker.position[1], c='blue')
     
     # Plot target
-    target = ax.scatter(worker.target.position[0], worker.target.position[1], c='green')
+    target = ax.scatter(worker.target_patient.position[0], worker.target_patient.position[1], c='green')
     
     # Add text for time step
     time_step_text = ax.text(0.02, 0.95, '', transform=ax.transAxes)
@@ -321,7 +277,7 @@ def main():
         nonlocal arrow
         worker.update(bounds=bounds)
         sc2.set_offsets([worker.position])
-        target.set_offsets([worker.target.position])
+        target.set_offsets([worker.target_patient.position])
         
         # Update time step text
         time_step_text.set_text(f'Time Step: {frame}')
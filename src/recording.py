@@ -0,0 +1,60 @@
+import shutil
+import subprocess
+import numpy as np
+import matplotlib
+from PIL import Image
+
+# Write RGBA frames (arrays of shape (height, width, 4)) to a file without showing them, so recordings can be made on a headless machine
+# A .gif is written with Pillow, a filename with a {} placeholder (e.g. "frames/{:05d}.png") is written as one image per frame
+# and anything else (e.g. .mp4) is piped to ffmpeg
+class FrameWriter:
+    def __init__(self, filename, fps=30):
+        self.filename = filename
+        self.fps = fps
+        self.num_frames = 0
+        
+        if "{" in filename:
+            self.format = "sequence"
+        elif filename.lower().endswith(".gif"):
+            self.format = "gif"
+            self.frames = [] # Pillow writes every frame of a GIF at once, each frame is kept with its own 256 colour palette
+        else:
+            self.format = "ffmpeg"
+            self.ffmpeg_path = shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+            if self.ffmpeg_path is None:
+                raise RuntimeError(f"ffmpeg is needed to write {filename}, record to a .gif or a sequence of images instead")
+            self.process = None
+    
+    def write(self, frame):
+        if self.format == "sequence":
+            Image.fromarray(frame).save(self.filename.format(self.num_frames))
+        
+        elif self.format == "gif":
+            self.frames.append(Image.fromarray(frame).convert("RGB").quantize())
+        
+        else:
+            # Start ffmpeg once the frame size is known, padding to even dimensions as most video codecs need
+            if self.process is None:
+                height, width = frame.shape[:2]
+                self.process = subprocess.Popen([self.ffmpeg_path, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+                                                 "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", self.filename], stdin=subprocess.PIPE)
+            self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        
+        self.num_frames += 1
+    
+    def close(self):
+        if self.format == "gif" and len(self.frames) > 0:
+            self.frames[0].save(self.filename, save_all=True, append_images=self.frames[1:], duration=1000 / self.fps, loop=0)
+            self.frames = []
+        
+        elif self.format == "ffmpeg" and self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to write {self.filename}")
+            self.process = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,146 @@
+import os
+import math
+import struct
+from itertools import islice
+import numpy as np
+
+# Columnar results store: one row per infection in a structured array, saved as a .npy file so it can be memory mapped
+RESULT_DTYPE = np.dtype([("simulation", "<i4"), ("type", "u1"), ("id", "<u4"), ("timestep", "<i4")])
+TYPE_CODES = {"patient": 0, "worker": 1}
+TYPE_NAMES = ["patient", "worker"]
+
+# Size of the .npy header, big enough for any shape so the header can be rewritten in place once the number of rows is known
+MAX_HEADER = repr({"descr": np.lib.format.dtype_to_descr(RESULT_DTYPE), "fortran_order": False, "shape": (2**63,)})
+HEADER_SIZE = math.ceil((len(MAX_HEADER) + 11) / 64) * 64
+
+# Write a version 1.0 .npy header padded to HEADER_SIZE bytes
+def write_header(file, num_rows):
+    header = repr({"descr": np.lib.format.dtype_to_descr(RESULT_DTYPE), "fortran_order": False, "shape": (num_rows,)})
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+# Convert infection records (dicts with type, id and timestep) from one simulation into rows
+def records_to_rows(simulation, infection_record):
+    rows = np.empty(len(infection_record), dtype=RESULT_DTYPE)
+    rows["simulation"] = simulation
+    rows["type"] = [TYPE_CODES[record["type"]] for record in infection_record]
+    rows["id"] = [int(record["id"], 16) for record in infection_record]
+    rows["timestep"] = [record["timestep"] for record in infection_record]
+    return rows
+
+# Stream rows to a .npy file as simulations finish, the header is updated with the number of rows after every write
+# so an interrupted run leaves a valid file holding every simulation written so far
+class ResultsWriter:
+    def __init__(self, filename, append=False):
+        if append and os.path.exists(filename):
+            # Carry on after the rows in the header, dropping anything written after the last header update
+            self.file = open(filename, "r+b")
+            np.lib.format.read_magic(self.file)
+            self.num_rows = np.lib.format.read_array_header_1_0(self.file)[0][0]
+            if self.file.tell() != HEADER_SIZE:
+                raise ValueError(f"{filename} was not written by a ResultsWriter")
+            self.file.truncate(HEADER_SIZE + self.num_rows * RESULT_DTYPE.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(filename, "wb")
+            self.num_rows = 0
+            write_header(self.file, 0)
+    
+    # Append the infection record of one simulation
+    def write(self, simulation, infection_record):
+        self.write_rows(records_to_rows(simulation, infection_record))
+    
+    def write_rows(self, rows):
+        self.file.write(np.ascontiguousarray(rows, dtype=RESULT_DTYPE).tobytes())
+        self.num_rows += len(rows)
+        
+        # The rows are flushed by the seek before the header counting them is written
+        self.file.seek(0)
+        write_header(self.file, self.num_rows)
+        self.file.seek(0, os.SEEK_END)
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+# Save the results of several simulations at once
+def save_results(filename, sim_results):
+    with ResultsWriter(filename) as writer:
+        for i, sim_result in enumerate(sim_results):
+            writer.write(i, sim_result)
+
+# Load a results file as a read-only memory map, nothing is read until the rows are used
+def load_results(filename):
+    return np.load(filename, mmap_mode="r")
+
+# Convert rows back into a list of infection records (lists of dicts) per simulation, in simulation order
+def rows_to_sim_results(rows):
+    num_sims = int(rows["simulation"].max()) + 1 if len(rows) > 0 else 0
+    
+    # Group the rows by simulation, keeping the order of the rows within each simulation
+    order = np.argsort(rows["simulation"], kind="stable")
+    rows = rows[order]
+    splits = np.searchsorted(rows["simulation"], np.arange(1, num_sims))
+    
+    # Build the records from plain Python lists of each column rather than row by row
+    types = [TYPE_NAMES[code] for code in rows["type"].tolist()]
+    ids = [f"{person_id:08x}" for person_id in rows["id"].tolist()]
+    timesteps = rows["timestep"].tolist()
+    bounds = zip([0] + splits.tolist(), splits.tolist() + [len(rows)])
+    return [[{
+        "type": types[i],
+        "id": ids[i],
+        "timestep": timesteps[i]
+    } for i in range(start, end)] for start, end in bounds]
+
+# Parse an array of 8 character hex strings into integers
+def parse_hex_ids(ids):
+    digits = np.ascontiguousarray(ids, dtype="U8").view(np.uint32).reshape(len(ids), 8).astype(np.int64)
+    values = np.where(digits >= ord("a"), digits - ord("a") + 10, np.where(digits >= ord("A"), digits - ord("A") + 10, digits - ord("0")))
+    return (values << (4 * np.arange(7, -1, -1))).sum(axis=1).astype(np.uint32)
+
+# Read a csv results file (Simulation,Type,ID,Timestep) in chunks of rows, parsing each chunk in one go
+def read_csv_rows(csv_filename, chunk_size=65536):
+    csv_dtype = [("simulation", "<i4"), ("type", "U7"), ("id", "U8"), ("timestep", "<i4")]
+    with open(csv_filename, "r") as file:
+        file.readline() # Skip the header
+        while True:
+            lines = list(islice(file, chunk_size))
+            if len(lines) == 0:
+                return
+            
+            columns = np.loadtxt(lines, delimiter=",", dtype=csv_dtype, ndmin=1)
+            rows = np.empty(len(columns), dtype=RESULT_DTYPE)
+            rows["simulation"] = columns["simulation"]
+            rows["type"] = columns["type"] == "worker"
+            rows["id"] = parse_hex_ids(columns["id"])
+            rows["timestep"] = columns["timestep"]
+            yield rows
+
+# Load a csv results file into a single array of rows
+def load_csv_rows(csv_filename, chunk_size=65536):
+    return np.concatenate([np.empty(0, dtype=RESULT_DTYPE)] + list(read_csv_rows(csv_filename, chunk_size)))
+
+# Convert a csv results file to the columnar format, streaming it one chunk at a time
+def convert_csv(csv_filename, filename=None, chunk_size=65536):
+    if filename is None:
+        filename = csv_filename.rsplit(".", 1)[0] + ".npy"
+    
+    with ResultsWriter(filename) as writer:
+        for rows in read_csv_rows(csv_filename, chunk_size):
+            writer.write_rows(rows)
+    
+    return filename
+
+def main():
+    # Convert the saved csv results
+    for csv_filename in ["data/masked_25_results.csv", "data/unmasked_25_results.csv"]:
+        print(f"Converted {csv_filename} to {convert_csv(csv_filename)}")
+
+if __name__ == "__main__":
+    main()
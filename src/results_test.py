@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from results import ResultsWriter, load_results, rows_to_sim_results, convert_csv
+from main import get_simulation_results
+
+class TestResults(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sim_results = [
+            [{"type": "patient", "id": "0a1b2c3d", "timestep": 0}, {"type": "worker", "id": "ffffffff", "timestep": 12}],
+            [{"type": "patient", "id": "00000001", "timestep": 0}]
+        ]
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def test_streamed_results_round_trip(self):
+        filename = os.path.join(self.directory.name, "results.npy")
+        with ResultsWriter(filename) as writer:
+            # Simulations can finish in any order
+            writer.write(1, self.sim_results[1])
+            writer.write(0, self.sim_results[0])
+        
+        rows = load_results(filename)
+        self.assertIsInstance(rows, np.memmap)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows_to_sim_results(rows), self.sim_results)
+    
+    def test_resume_only_the_same_run(self):
+        filename = os.path.join(self.directory.name, "results.npy")
+        sim_results = get_simulation_results(masked=True, repeat_sims=1, save_results=True, seed=1, results_filename=filename)
+        
+        # Resuming with the same arguments loads the saved results, and resuming a different run is refused
+        self.assertEqual(get_simulation_results(masked=True, repeat_sims=1, save_results=True, seed=1, results_filename=filename, resume=True), sim_results)
+        with self.assertRaises(ValueError):
+            get_simulation_results(masked=False, repeat_sims=1, save_results=True, seed=2, results_filename=filename, resume=True)
+        
+        # Without resuming the results file is overwritten
+        other_results = get_simulation_results(masked=False, repeat_sims=1, save_results=True, seed=2, results_filename=filename)
+        self.assertEqual(rows_to_sim_results(load_results(filename)), other_results)
+        self.assertNotEqual(other_results, sim_results)
+    
+    def test_append_after_interrupted_write(self):
+        filename = os.path.join(self.directory.name, "results.npy")
+        writer = ResultsWriter(filename)
+        writer.write(1, self.sim_results[1])
+        writer.close()
+        
+        # A partly written row after the last header update is dropped when appending
+        with open(filename, "ab") as file:
+            file.write(b"\x00" * 5)
+        with ResultsWriter(filename, append=True) as writer:
+            self.assertEqual(writer.num_rows, 1)
+            writer.write(0, self.sim_results[0])
+        
+        self.assertEqual(rows_to_sim_results(load_results(filename)), self.sim_results)
+    
+    def test_convert_csv(self):
+        csv_filename = os.path.join(self.directory.name, "results.csv")
+        with open(csv_filename, "w") as file:
+            file.write("Simulation,Type,ID,Timestep\n")
+            for i, sim_result in enumerate(self.sim_results):
+                for record in sim_result:
+                    file.write(f"{i},{record['type']},{record['id']},{record['timestep']}\n")
+        
+        filename = convert_csv(csv_filename, chunk_size=2)
+        self.assertEqual(filename, os.path.join(self.directory.name, "results.npy"))
+        self.assertEqual(rows_to_sim_results(load_results(filename)), self.sim_results)
+
+if __name__ == '__main__':
+    unittest.main()
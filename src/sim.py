@@ -1,40 +1,67 @@
+import os
+import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from tqdm import tqdm
-from ward import Ward
-from person import Patient, Worker
-from particle import ParticleManager
+from ward import create_layout
+from person import Patient, Worker, PersonParameters
+from particle import ParticleManager, ArrayParticleManager
+from engine import VectorizedEngine
+from recording import FrameWriter
+from trajectory import StateRecorder
+
+# Create the ward, or floor of several wards, that a simulation runs on
+def create_simulation_layout(wards, bays, beds):
+    return create_layout(wards=wards, bays=bays, beds=beds, bay_length=12, bay_width=8, corridor_width=4)
+
+# Number of people in a simulation, a patient in every bed of its layout and its workers, without creating the simulation
+def get_total_people(wards, bays, beds, num_workers):
+    return len(create_simulation_layout(wards, bays, beds).bed_positions) + num_workers
 
 # Define simulation class using parameters from the project report
 class Simulation:
-    def __init__(self, max_timesteps=(12*60*60)/10, masked=False, initial_infected=2):
+    def __init__(self, max_timesteps=(12*60*60)/10, masked=False, initial_infected=2, particle_backend="array", engine="object", seed=None, history_length=0,
+                 vaccination_rate=0.882, num_workers=7, airborne_half_life=1, surface_half_life=7, airborne_spread=3.95, surface_spread=0.8, airborne_mean_particles=8, surface_mean_particles=2, person_parameters=None, bays=2, beds=3, wards=1):
         self.max_timesteps = int(max_timesteps)
         self.masked = masked
+        self.particle_backend = particle_backend # "array" (structure-of-arrays buffers) or "object" (Particle objects)
+        self.engine = engine # "object" (steps Person objects) or "vectorized" (steps NumPy arrays of people state)
+        self.history_length = history_length # Number of previous positions kept for each worker (0 keeps none)
+        
+        # The simulation owns the random number generator, each component gets its own child generator (stream) from it
+        self.rng = np.random.default_rng(seed)
+        self.exposure_rng, self.movement_rng, airborne_rng, surface_rng = self.rng.spawn(4)
         
         # Set COVID-19 parameters
-        self.airborne_half_life = 1 # Half-life of airborne particles in hours
-        self.surface_half_life = 7 # Half-life of surface particles in hours
-        self.airborne_spread = 3.95
-        self.surface_spread = 0.8
-        self.airborne_mean_particles = 8
-        self.surface_mean_particles = 2 
+        self.airborne_half_life = airborne_half_life # Half-life of airborne particles in hours
+        self.surface_half_life = surface_half_life # Half-life of surface particles in hours
+        self.airborne_spread = airborne_spread
+        self.surface_spread = surface_spread
+        self.airborne_mean_particles = airborne_mean_particles
+        self.surface_mean_particles = surface_mean_particles
+        
+        # Infection and mask parameters shared by everyone
+        self.person_parameters = person_parameters if person_parameters is not None else PersonParameters()
 
-        # Create a ward
-        self.ward = Ward(bays=2, beds=3, bay_length=12, bay_width=8, corridor_width=4)
+        # Create a ward, or a floor of several wards
+        self.ward = create_simulation_layout(wards, bays, beds)
         
         # Position patients in the beds
-        vaccination_rate = 0.882
+        self.vaccination_rate = vaccination_rate
         self.patients = []
-        for bed in self.ward.bed_positions:
-            patient = Patient(position=bed)
+        vaccinations = self.rng.uniform(0, 1, len(self.ward.bed_positions))
+        for bed, patient_rng, vaccination in zip(self.ward.bed_positions, self.rng.spawn(len(self.ward.bed_positions)), vaccinations):
+            patient = Patient(position=bed, rng=patient_rng, parameters=self.person_parameters)
             self.patients.append(patient)
             
             # Mask the patient if required
             patient.masked = self.masked
             
             # Vaccinate the patient
-            if np.random.uniform(0, 1) < vaccination_rate:
+            if vaccination < self.vaccination_rate:
                 #print("Vaccinated")
                 patient.vaccinated = True
             else:
@@ -42,22 +69,22 @@ class Simulation:
                 pass
             
         # Infect random patients
-        infected_patients = np.random.choice(self.patients, initial_infected, replace=False)
+        infected_patients = self.rng.choice(self.patients, initial_infected, replace=False)
         for patient in infected_patients:
             patient.infected = True
             
         # Create workers
-        num_workers = 7
         self.workers = []
-        for i in range(num_workers):
-            worker = Worker(self.patients, self.ward, position=np.array([0.0,5.0]), step_length=0.5)
+        for worker_rng in self.rng.spawn(num_workers):
+            worker = Worker(self.patients, self.ward, position=self.ward.entrance.copy(), step_length=0.5, rng=worker_rng, parameters=self.person_parameters, history_length=history_length)
             worker.masked = self.masked
             worker.vaccinated = True
             self.workers.append(worker)
             
         # Create the particle managers
-        self.airborne_particles = ParticleManager(half_life=self.airborne_half_life, spread=self.airborne_spread, mean_particles=self.airborne_mean_particles, ward=self.ward)
-        self.surface_particles = ParticleManager(half_life=self.surface_half_life, spread=self.surface_spread, mean_particles=self.surface_mean_particles, ward=self.ward)
+        particle_manager = ArrayParticleManager if self.particle_backend == "array" else ParticleManager
+        self.airborne_particles = particle_manager(half_life=self.airborne_half_life, spread=self.airborne_spread, mean_particles=self.airborne_mean_particles, ward=self.ward, rng=airborne_rng)
+        self.surface_particles = particle_manager(half_life=self.surface_half_life, spread=self.surface_spread, mean_particles=self.surface_mean_particles, ward=self.ward, rng=surface_rng)
         
         # Set the total number of people and infected people
         self.total_people = len(self.patients) + len(self.workers)
@@ -72,112 +99,305 @@ class Simulation:
                     "id": patient.id,
                     "timestep": 0
                 })
+        
+        # People infected since the last update are buffered, then logged once (patients before workers, as in the record above)
+        self.newly_infected = []
+        self.recorded_ids = set(record["id"] for record in self.infection_record)
+        self.record_order = {person: i for i, person in enumerate(self.patients + self.workers)}
+        
+        # Next timestep to run and the vectorised engine state, kept on the simulation so a checkpoint can carry on where it stopped
+        self.timestep = 0
+        self.vectorized_engine = None
+        
+        # Timers and counters, only while an instrumented run is going
+        self.instrumentation = None
+    
+    # Save the full state of the simulation (people, particles, generators and infection record) to a checkpoint file
+    # The file is replaced in one step, so an interruption while saving leaves the previous checkpoint
+    # The instrumentation of the run is not part of the state, so it is detached while saving
+    def save_checkpoint(self, filename):
+        instrumentation = self.instrumentation
+        self.set_instrumentation(None)
+        try:
+            with open(filename + ".tmp", "wb") as file:
+                pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            self.set_instrumentation(instrumentation)
+        os.replace(filename + ".tmp", filename)
+    
+    # Load a simulation from a checkpoint file, running it carries on exactly as if it had not stopped
+    @staticmethod
+    def load_checkpoint(filename):
+        with open(filename, "rb") as file:
+            return pickle.load(file)
+    
+    # Infect a person, buffering them to be added to the infection record
+    def infect(self, person):
+        if not person.infected:
+            person.infected = True
+            self.newly_infected.append(person)
     
         
-    def run(self, render=False):  
+    # Create the particles for all infected people in one call per particle manager
+    def emit_particles(self, timestep):
+        infected = [person for person in self.workers + self.patients if person.infected]
+        if len(infected) == 0:
+            return
         
-        # Render components
-        if render:
-            # Setup the plot
-            fig, ax = plt.subplots()
-            ax.set_aspect('equal')
-            ax.axis('off')
-            
-            # Render the ward
-            self.ward.render(ax)
-            
-            # Render the people
-            worker_renders = [self.workers[i].render(ax) for i in range(len(self.workers))]
-            
-            for patient in self.patients:
-                patient.render(ax)
-            
-            # Render the particles
-            airborne_render = self.airborne_particles.render(ax, color='hotpink')
-            surface_render = self.surface_particles.render(ax, color='purple')
-            
-            # Render the masks
-            for worker in self.workers:
-                if worker.masked:
-                    ax.add_patch(plt.Circle(worker.position, 0.6, facecolor='blue', zorder=8))
-                    
-            for patient in self.patients:
-                if patient.masked:
-                    ax.add_patch(plt.Circle(patient.position, 0.6, facecolor='blue', zorder=8))
+        # Masks reduce the spread and number of airborne particles plus eliminate surface particles
+        origins = np.array([person.position for person in infected])
+        masked = np.array([person.masked for person in infected])
+        reduction_particles = np.array([person.masked_airborne_reduction_particles if person.masked else 1 for person in infected])
+        reduction_spread = np.array([person.masked_airborne_reduction_spread if person.masked else 1 for person in infected])
+        
+        self.airborne_particles.create_particles_batch(timestep, origins, reduction_particles, reduction_spread)
+        self.surface_particles.create_particles_batch(timestep, origins[~masked])
+        
+    # Check all uninfected people for particle collisions with one query per particle manager
+    def check_exposure(self, head_radius=0.2):
+        susceptible = [person for person in self.workers + self.patients if not person.infected]
+        if len(susceptible) == 0:
+            return
+        
+        # Get the number of particles that have collided with each person
+        positions = np.array([person.position for person in susceptible])
+        total_collisions = self.airborne_particles.count_particles(positions, head_radius) + self.surface_particles.count_particles(positions, head_radius)
+        
+        # Accept or reject the infection of everyone with collisions
+        exposed = np.flatnonzero(total_collisions > 0)
+        infection_probability = np.array([susceptible[i].infection_probability for i in exposed])
+        acceptance_probability = 1 - (1 - infection_probability) ** total_collisions[exposed]
+        random_values = self.exposure_rng.uniform(0, 1, len(exposed))
+        for i in exposed[random_values < acceptance_probability]:
+            self.infect(susceptible[i])
+        
+    # Advance the Person objects by one timestep
+    def update_objects(self, timestep):
+        # Each phase is timed if the run is instrumented
+        timer = self.instrumentation
+        if timer is not None:
+            timer.start()
+        
+        # Create the particles for every infected person in one batch
+        self.emit_particles(timestep)
+        if timer is not None:
+            timer.lap("emission")
+        
+        # Check every uninfected person for particle collisions in one batch
+        self.check_exposure()
+        if timer is not None:
+            timer.lap("exposure")
+        
+        # Move the workers, proposing their new directions in one batch
+        target_positions = [worker.update_target(self.ward) for worker in self.workers]
+        if timer is not None:
+            timer.lap("targets")
+        proposals = Worker.propose_moves(self.workers, self.ward)
+        moves = [worker.move(target_position, self.ward, proposal) for worker, target_position, proposal in zip(self.workers, target_positions, proposals)]
+        if timer is not None:
+            timer.lap("movement")
             
-            # Add time step text outside of the plot
-            timestep_text = ax.text(0.02, 0.95, '', transform=fig.transFigure)
+            # Workers whose new direction is not a valid move stay still
+            timer.count("proposals", len(moves))
+            timer.count("proposals_accepted", sum(accepted for accepted, _ in moves))
+            timer.count("moves_blocked", sum(not moving for _, moving in moves))
             
-            # Add infection count text outside of the plot
-            infection_text = ax.text(0.02, 0.90, '', transform=fig.transFigure)
+        # Update the particles
+        self.airborne_particles.update(timestep)
+        self.surface_particles.update(timestep)
+        if timer is not None:
+            timer.lap("decay")
+        
+        # Add the newly infected people to the infection record and the running count of infected people
+        self.newly_infected.sort(key=self.record_order.get)
+        for person in self.newly_infected:
+            if person.id not in self.recorded_ids:
+                self.infection_record.append({
+                    "type": person.type,
+                    "id": person.id,
+                    "timestep": timestep
+                })
+                self.recorded_ids.add(person.id)
+                self.total_infected += 1
+        self.newly_infected.clear()
+        if timer is not None:
+            timer.lap("records")
+        
+    # Set (or with None, remove) the instrumentation of the simulation, its particle managers and its vectorised engine
+    def set_instrumentation(self, instrumentation):
+        self.instrumentation = instrumentation
+        if self.vectorized_engine is not None:
+            self.vectorized_engine.instrumentation = instrumentation
+        
+        num_rooms = len(self.ward.room_names)
+        self.airborne_particles.counters = instrumentation.get_particle_counters("airborne", num_rooms) if instrumentation is not None else None
+        self.surface_particles.counters = instrumentation.get_particle_counters("surface", num_rooms) if instrumentation is not None else None
+    
+    # Draw the ward, people and particles, returning the renders that change from frame to frame
+    def create_render(self, fig, ax):
+        ax.set_aspect('equal')
+        ax.axis('off')
+        
+        # Render the ward
+        self.ward.render(ax)
+        
+        # Render the people
+        worker_renders = [worker.render(ax) for worker in self.workers]
+        
+        for patient in self.patients:
+            patient.render(ax)
+        
+        # Render the particles
+        airborne_render = self.airborne_particles.render(ax, color='hotpink')
+        surface_render = self.surface_particles.render(ax, color='purple')
+        
+        # Render the masks, the workers' masks move with them
+        mask_renders = {w: ax.add_patch(plt.Circle(worker.position, 0.6, facecolor='blue', zorder=8)) for w, worker in enumerate(self.workers) if worker.masked}
+        
+        for patient in self.patients:
+            if patient.masked:
+                ax.add_patch(plt.Circle(patient.position, 0.6, facecolor='blue', zorder=8))
+        
+        # Add time step text outside of the plot
+        timestep_text = ax.text(0.02, 0.95, '', transform=fig.transFigure)
+        
+        # Add infection count text outside of the plot
+        infection_text = ax.text(0.02, 0.90, '', transform=fig.transFigure)
+        
+        return {
+            "workers": worker_renders,
+            "masks": mask_renders,
+            "airborne": airborne_render,
+            "surface": surface_render,
+            "timestep": timestep_text,
+            "infection": infection_text
+        }
+    
+    # Get the worker positions and who is infected (workers then patients) as arrays
+    # The vectorised engine's arrays are read directly rather than syncing the Person objects
+    def get_people_state(self):
+        if self.vectorized_engine is not None:
+            return self.vectorized_engine.positions[0, :len(self.workers)], self.vectorized_engine.infected[0]
+        return np.array([worker.position for worker in self.workers]), np.array([person.infected for person in self.workers + self.patients])
+    
+    # Update the changing renders for a timestep straight from the position arrays, returning the updated artists
+    def update_render(self, renders, timestep):
+        worker_positions, infected = self.get_people_state()
+        infected_workers = np.count_nonzero(infected[:len(self.workers)])
+        infected_patients = np.count_nonzero(infected[len(self.workers):])
+        
+        # Update the time step and infection count text
+        renders["timestep"].set_text(f'Time step: {timestep}/{self.max_timesteps}')
+        renders["infection"].set_text(f'Infected: {self.total_infected}/{self.total_people} ({infected_patients} patients, {infected_workers} workers)')
+        
+        # Update the workers and their masks
+        for worker_render, position in zip(renders["workers"], worker_positions):
+            worker_render.set_center(tuple(position))
+        for w, mask_render in renders["masks"].items():
+            mask_render.set_center(tuple(worker_positions[w]))
+        
+        # Update the particles
+        renders["airborne"].set_offsets(self.airborne_particles.positions)
+        renders["surface"].set_offsets(self.surface_particles.positions)
+        
+        # In drawing order, as blitted artists are drawn in the order given
+        artists = renders["workers"] + list(renders["masks"].values()) + [renders["airborne"], renders["surface"], renders["timestep"], renders["infection"]]
+        return sorted(artists, key=lambda artist: artist.get_zorder())
+    
+    # Run the simulation, saving a checkpoint every checkpoint_interval timesteps (360 is an hour) if a checkpoint file is given
+    # If a record file is given the run is recorded without being shown (see FrameWriter for the formats), drawing a frame every frame_stride timesteps
+    # If a state directory is given a snapshot of every timestep is saved to it for replaying later (see StateRecorder)
+    # If an Instrumentation is given the phases of every timestep are timed and counted in it
+    def run(self, render=False, progress=True, checkpoint_filename=None, checkpoint_interval=360, record_filename=None, frame_stride=10, fps=30, dpi=100, state_directory=None, state_chunk_size=360, instrumentation=None):
+        # Recording is only done headless
+        if render and (record_filename is not None or state_directory is not None):
+            raise ValueError("record_filename and state_directory can't be used with render=True, run headless to record")
+        if render and instrumentation is not None:
+            raise ValueError("instrumentation can't be used with render=True, run headless to instrument")
+        
+        # The vectorised engine keeps the people state in arrays and advances a whole timestep at once
+        if self.engine == "vectorized" and self.vectorized_engine is None:
+            self.vectorized_engine = VectorizedEngine([self])
+        
+        # Give the instrumentation to everything it times or counts
+        self.set_instrumentation(instrumentation)
         
         # Run the simulation until the maximum number of timesteps is reached or everyone is infected
         def update(timestep):
-            # Update the workers
-            for worker in self.workers:
-                worker.update(timestep, self.airborne_particles, self.surface_particles, self.ward)
-                
-            # Update the patients
-            for patient in self.patients:
-                patient.update(timestep, self.airborne_particles, self.surface_particles, self.ward)
-                
-            # Update the particles
-            self.airborne_particles.update(timestep)
-            self.surface_particles.update(timestep)
+            if self.engine == "vectorized":
+                self.total_infected = int(self.vectorized_engine.step(timestep)[0])
             
-            # Add to the infection record
-            for patient in self.patients:
-                if patient.infected and not any([record["id"] == patient.id for record in self.infection_record]):
-                    self.infection_record.append({
-                        "type": "patient",
-                        "id": patient.id,
-                        "timestep": timestep
-                    })
-                    
-            for worker in self.workers:
-                if worker.infected and not any([record["id"] == worker.id for record in self.infection_record]):
-                    self.infection_record.append({
-                        "type": "worker",
-                        "id": worker.id,
-                        "timestep": timestep
-                    })
-                    
-            # Check if everyone is infected
-            self.total_infected = sum([1 for patient in self.patients if patient.infected]) + sum([1 for worker in self.workers if worker.infected])
+            else:
+                self.update_objects(timestep)
             
             if self.total_infected == self.total_people:
                 print(f"Everyone is infected at timestep {timestep}")
                 return False
+        
+        if render:
+            # Setup the plot
+            fig, ax = plt.subplots()
+            renders = self.create_render(fig, ax)
             
-            # Update the plot
-            if render:
-                # Update the time step text
-                timestep_text.set_text(f'Time step: {timestep}/{self.max_timesteps}')
-                
-                # Update the infection count text
-                infection_text.set_text(f'Infected: {self.total_infected}/{self.total_people} ({sum([1 for patient in self.patients if patient.infected])} patients, {sum([1 for worker in self.workers if worker.infected])} workers)')
+            # Stop advancing the simulation once everyone is infected
+            def animate(timestep):
+                if self.total_infected < self.total_people:
+                    update(timestep)
+                return self.update_render(renders, timestep)
+            
+            ani = animation.FuncAnimation(fig, animate, frames=self.max_timesteps, blit=False)
+            plt.show()
+        
+        else: # Run headless
+            # Record on an Agg canvas with no window, blitting the changing renders over the static background (the ward and patients)
+            if record_filename is not None:
+                fig = Figure(dpi=dpi)
+                canvas = FigureCanvasAgg(fig)
+                ax = fig.add_subplot()
+                renders = self.create_render(fig, ax)
+                artists = self.update_render(renders, self.timestep)
+                for artist in artists:
+                    artist.set_animated(True)
+                canvas.draw()
+                background = canvas.copy_from_bbox(fig.bbox)
+                writer = FrameWriter(record_filename, fps)
                 
-                # Update the workers
-                for worker_render in worker_renders:
-                    worker_render.set_center((self.workers[worker_renders.index(worker_render)].position[0], self.workers[worker_renders.index(worker_render)].position[1]))
+                def record_frame(timestep):
+                    canvas.restore_region(background)
+                    for artist in self.update_render(renders, timestep):
+                        fig.draw_artist(artist)
+                    writer.write(np.asarray(canvas.buffer_rgba()))
+            
+            state_recorder = StateRecorder(state_directory, self, state_chunk_size) if state_directory is not None else None
+            
+            try:
+                for timestep in tqdm(range(self.timestep, self.max_timesteps), initial=self.timestep, total=self.max_timesteps, disable=not progress):
+                    update(timestep)
+                    self.timestep = timestep + 1
+                    if state_recorder is not None:
+                        state_recorder.record(timestep)
+                    if instrumentation is not None:
+                        instrumentation.end_timestep(timestep, airborne_particles=len(self.airborne_particles), surface_particles=len(self.surface_particles), infected=self.total_infected)
+                    if record_filename is not None and (timestep % frame_stride == 0 or self.total_infected == self.total_people):
+                        record_frame(timestep)
                     
-                # Update the particles
-                if len(self.airborne_particles.particles.items) > 0:
-                    airborne_render.set_offsets([p.position for p in self.airborne_particles.particles.items])
-                if len(self.surface_particles.particles.items) > 0:
-                    surface_render.set_offsets([p.position for p in self.surface_particles.particles.items])
-                
-        if render:
-            ani = animation.FuncAnimation(fig, update, frames=self.max_timesteps, blit=False)
-            plt.show()
+                    if self.total_infected == self.total_people:
+                        #print(f"Infection record: {self.infection_record}")
+                        #print(len(self.infection_record))
+                        break
+                    
+                    if checkpoint_filename is not None and self.timestep % checkpoint_interval == 0:
+                        self.save_checkpoint(checkpoint_filename)
             
-        else: # Run headless
-            for timestep in tqdm(range(self.max_timesteps)):
-                update(timestep)
-                if self.total_infected == self.total_people:
-                    #print(f"Infection record: {self.infection_record}")
-                    #print(len(self.infection_record))
-                    break
+            finally:
+                if record_filename is not None:
+                    writer.close()
+                if state_recorder is not None:
+                    state_recorder.close()
+                self.set_instrumentation(None)
+            
+            if self.engine == "vectorized":
+                self.vectorized_engine.sync()
                 
         
 def main():
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from sim import Simulation
+from instrumentation import Instrumentation, PHASES
+from person import Person
+
+class TestInfectionProbability(unittest.TestCase):
+    def test_default_infection_probability(self):
+        # The innate probability, reduced by masks and vaccination as they are given out
+        person = Person()
+        self.assertAlmostEqual(person.infection_probability, 0.55)
+        person.masked = True
+        self.assertAlmostEqual(person.infection_probability, 0.55 * 0.6)
+        person.vaccinated = True
+        self.assertAlmostEqual(person.infection_probability, 0.55 * 0.6 * 0.8)
+
+class TestCheckpoint(unittest.TestCase):
+    def test_resumed_run_matches_uninterrupted_run(self):
+        for engine in ["object", "vectorized"]:
+            with self.subTest(engine=engine), tempfile.TemporaryDirectory() as directory:
+                sim = Simulation(max_timesteps=300, engine=engine, seed=3)
+                sim.run(progress=False)
+                
+                # Checkpoints are saved at timesteps 120 and 240, carry on from the last one
+                filename = os.path.join(directory, "checkpoint.pkl")
+                Simulation(max_timesteps=300, engine=engine, seed=3).run(progress=False, checkpoint_filename=filename, checkpoint_interval=120)
+                resumed_sim = Simulation.load_checkpoint(filename)
+                self.assertEqual(resumed_sim.timestep, 240)
+                resumed_sim.run(progress=False)
+                
+                self.assertEqual(resumed_sim.infection_record, sim.infection_record)
+                self.assertEqual([worker.position.tolist() for worker in resumed_sim.workers], [worker.position.tolist() for worker in sim.workers])
+                self.assertEqual(resumed_sim.movement_rng.bit_generator.state, sim.movement_rng.bit_generator.state)
+                self.assertEqual(resumed_sim.exposure_rng.bit_generator.state, sim.exposure_rng.bit_generator.state)
+
+class TestRecording(unittest.TestCase):
+    def test_recording_does_not_change_the_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sim = Simulation(max_timesteps=100, masked=True, seed=3)
+            sim.run(progress=False)
+            
+            recorded_sim = Simulation(max_timesteps=100, masked=True, seed=3)
+            recorded_sim.run(progress=False, record_filename=os.path.join(directory, "frame_{:03d}.png"), frame_stride=25)
+            
+            self.assertEqual(recorded_sim.infection_record, sim.infection_record)
+            self.assertEqual(sorted(os.listdir(directory)), [f"frame_{i:03d}.png" for i in range(4)])
+
+class TestInstrumentation(unittest.TestCase):
+    def test_instrumented_run_matches_and_counts(self):
+        for engine in ["object", "vectorized"]:
+            with self.subTest(engine=engine):
+                sim = Simulation(max_timesteps=200, engine=engine, seed=5)
+                sim.run(progress=False)
+                
+                instrumentation = Instrumentation(trace=True)
+                instrumented_sim = Simulation(max_timesteps=200, engine=engine, seed=5)
+                instrumented_sim.run(progress=False, instrumentation=instrumentation)
+                summary = instrumentation.summary()
+                
+                self.assertEqual(instrumented_sim.infection_record, sim.infection_record)
+                self.assertEqual(summary["timesteps"], instrumented_sim.timestep)
+                self.assertEqual(len(instrumentation.trace), instrumented_sim.timestep)
+                self.assertEqual(set(summary["phases"]), set(PHASES))
+                self.assertEqual(summary["counters"]["proposals"], len(sim.workers) * instrumented_sim.timestep)
+                self.assertEqual(instrumentation.trace[-1]["airborne_particles"], len(sim.airborne_particles))
+                
+                airborne = summary["particles"]["airborne"]
+                self.assertGreater(airborne["emitted"], airborne["discarded"])
+                # One collision query per uninfected person per timestep
+                infected_before = [2] + [row["infected"] for row in instrumentation.trace[:-1]]
+                self.assertEqual(airborne["queries"], sum(sim.total_people - infected for infected in infected_before))
+                
+                # The instrumentation is removed once the run is over
+                self.assertIsNone(instrumented_sim.instrumentation)
+                self.assertIsNone(instrumented_sim.airborne_particles.counters)
+    
+    def test_checkpoints_leave_out_the_instrumentation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "checkpoint.pkl")
+            Simulation(max_timesteps=100, seed=5).run(progress=False, checkpoint_filename=filename, checkpoint_interval=50, instrumentation=Instrumentation(trace=True))
+            checkpoint_sim = Simulation.load_checkpoint(filename)
+            
+            self.assertIsNone(checkpoint_sim.instrumentation)
+            self.assertIsNone(checkpoint_sim.airborne_particles.counters)
+            self.assertRaises(ValueError, checkpoint_sim.run, render=True, instrumentation=Instrumentation())
+
+if __name__ == '__main__':
+    unittest.main()
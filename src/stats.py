@@ -0,0 +1,113 @@
+import numpy as np
+
+# Build the (simulations, timesteps) matrix of the number of infections (after the first) at each timestep
+# Between infections the count is interpolated linearly, the same as np.interp over each simulation's infection timesteps
+def get_infection_curves(sim_results, timesteps):
+    curves = np.empty((len(sim_results), len(timesteps)))
+    for i, sim_result in enumerate(sim_results):
+        infection_timesteps = np.array([record["timestep"] for record in sim_result], dtype=float)
+        
+        # The last infection at or before each timestep, and the next one after it
+        last = np.searchsorted(infection_timesteps, timesteps, side="right") - 1
+        following = np.minimum(last + 1, len(infection_timesteps) - 1)
+        before_first = last < 0
+        last = np.maximum(last, 0)
+        
+        gap = infection_timesteps[following] - infection_timesteps[last]
+        fraction = np.where(gap > 0, (timesteps - infection_timesteps[last]) / np.where(gap > 0, gap, 1), 0)
+        curves[i] = np.where(before_first, 0, last + fraction)
+    
+    return curves
+
+# Streaming statistics of infection curves, using memory that does not grow with the number of simulations
+# Keeps the Welford mean and variance at each timestep, a histogram per timestep (a mergeable quantile sketch) for the percentiles,
+# and the mean and variance of the time taken to infect everyone. Accumulators from parallel workers can be merged
+class EnsembleStatistics:
+    def __init__(self, max_timesteps, max_infections, resolution=0.125):
+        self.timesteps = np.arange(int(max_timesteps))
+        self.resolution = resolution # Width of the histogram bins, in infections
+        self.num_bins = int(np.ceil(max_infections / resolution)) + 1
+        
+        self.count = 0
+        self.mean = np.zeros(len(self.timesteps))
+        self.m2 = np.zeros(len(self.timesteps))
+        self.histogram = np.zeros((len(self.timesteps), self.num_bins), dtype=np.int64)
+        
+        # Time taken to infect everyone (the last infection) and the longest of them, which is how far the curves are reported
+        self.final_mean = 0.0
+        self.final_m2 = 0.0
+        self.max_final_timestep = 0
+        
+        # Total number of people, taken from the first simulation as in get_average_and_percentiles
+        self.total_people = None
+    
+    # Add the infection record of one simulation
+    def add(self, infection_record):
+        self.add_batch([infection_record])
+    
+    # Add the infection records of several simulations at once
+    def add_batch(self, sim_results):
+        if len(sim_results) == 0:
+            return
+        if self.total_people is None:
+            self.total_people = len(sim_results[0])
+        
+        curves = get_infection_curves(sim_results, self.timesteps)
+        final_timesteps = np.array([sim_result[-1]["timestep"] for sim_result in sim_results], dtype=float)
+        
+        # Histogram of the curves at every timestep
+        bins = np.minimum(np.rint(curves / self.resolution).astype(np.int64), self.num_bins - 1)
+        self.histogram += np.bincount((np.arange(len(self.timesteps)) * self.num_bins + bins).ravel(), minlength=self.histogram.size).reshape(self.histogram.shape)
+        
+        # Combine the batch mean and variance with the running ones
+        self.combine(len(curves), curves.mean(axis=0), ((curves - curves.mean(axis=0)) ** 2).sum(axis=0), final_timesteps.mean(), ((final_timesteps - final_timesteps.mean()) ** 2).sum())
+        self.max_final_timestep = max(self.max_final_timestep, int(final_timesteps.max()))
+    
+    # Merge the statistics of another accumulator (e.g. from another worker) into this one
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.total_people is None:
+            self.total_people = other.total_people
+        
+        self.histogram += other.histogram
+        self.combine(other.count, other.mean, other.m2, other.final_mean, other.final_m2)
+        self.max_final_timestep = max(self.max_final_timestep, other.max_final_timestep)
+        return self
+    
+    # Chan et al.'s parallel update of the count, means and sums of squared differences
+    def combine(self, count, mean, m2, final_mean, final_m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        
+        final_delta = final_mean - self.final_mean
+        self.final_mean += final_delta * count / total
+        self.final_m2 += final_m2 + final_delta ** 2 * self.count * count / total
+        self.count = total
+    
+    # Standard deviation of the curves at each timestep
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+    
+    # Standard deviation of the time taken to infect everyone
+    @property
+    def final_std(self):
+        return np.sqrt(self.final_m2 / max(self.count, 1))
+    
+    # Estimate the q-th percentile at each timestep from the histograms, interpolating linearly between samples as np.percentile does
+    def percentile(self, q):
+        position = q / 100 * (self.count - 1)
+        cumulative = np.cumsum(self.histogram, axis=1)
+        
+        # Bins holding the samples either side of the position
+        lower = np.argmax(cumulative > np.floor(position), axis=1)
+        upper = np.argmax(cumulative > np.ceil(position), axis=1)
+        return (lower + (upper - lower) * (position - np.floor(position))) * self.resolution
+    
+    # Get the average and percentiles up to the longest time taken to infect everyone, like get_average_and_percentiles
+    def get_average_and_percentiles(self, lower_q=15.87, upper_q=84.13):
+        end = self.max_final_timestep + 1
+        return self.mean[:end], self.percentile(lower_q)[:end], self.percentile(upper_q)[:end], self.total_people
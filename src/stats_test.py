@@ -0,0 +1,52 @@
+import os
+import unittest
+import numpy as np
+from main import load_simulation_results, get_average_and_percentiles, SIMULATION_PARAMETERS
+from sim import Simulation, get_total_people
+from stats import EnsembleStatistics
+
+class TestEnsembleStatistics(unittest.TestCase):
+    def setUp(self):
+        self.sim_results = load_simulation_results(os.path.join(os.path.dirname(__file__), "..", "data", "unmasked_25_results.npy"))
+        self.max_timesteps = max(sim_result[-1]["timestep"] for sim_result in self.sim_results) + 1
+    
+    def test_matches_full_results(self):
+        statistics = EnsembleStatistics(self.max_timesteps, len(self.sim_results[0]), resolution=0.01)
+        for sim_result in self.sim_results:
+            statistics.add(sim_result)
+        
+        average, lower, upper, total_people = get_average_and_percentiles(self.sim_results)
+        streamed_average, streamed_lower, streamed_upper, streamed_total_people = statistics.get_average_and_percentiles()
+        final_timesteps = [sim_result[-1]["timestep"] for sim_result in self.sim_results]
+        
+        self.assertEqual(streamed_total_people, total_people)
+        np.testing.assert_allclose(streamed_average, average)
+        np.testing.assert_allclose(statistics.final_mean, np.mean(final_timesteps))
+        np.testing.assert_allclose(statistics.final_std, np.std(final_timesteps))
+        self.assertLessEqual(np.max(np.abs(streamed_lower - lower)), 0.01)
+        self.assertLessEqual(np.max(np.abs(streamed_upper - upper)), 0.01)
+    
+    def test_total_people_match_the_simulations(self):
+        # The statistics of the simulations run from main are sized from its parameters, on a ward and on a floor
+        for parameters in [SIMULATION_PARAMETERS, {**SIMULATION_PARAMETERS, "wards": 3, "bays": 1, "beds": 2, "num_workers": 10}]:
+            sim = Simulation(seed=0, **parameters)
+            self.assertEqual(sim.max_timesteps, parameters["max_timesteps"])
+            self.assertEqual(get_total_people(parameters["wards"], parameters["bays"], parameters["beds"], parameters["num_workers"]), sim.total_people)
+    
+    def test_merged_statistics_match(self):
+        statistics = EnsembleStatistics(self.max_timesteps, len(self.sim_results[0]))
+        statistics.add_batch(self.sim_results)
+        
+        merged = EnsembleStatistics(self.max_timesteps, len(self.sim_results[0]))
+        for i in range(0, len(self.sim_results), 7):
+            partial = EnsembleStatistics(self.max_timesteps, len(self.sim_results[0]))
+            partial.add_batch(self.sim_results[i:i + 7])
+            merged.merge(partial)
+        
+        self.assertEqual(merged.count, statistics.count)
+        np.testing.assert_allclose(merged.mean, statistics.mean)
+        np.testing.assert_allclose(merged.std, statistics.std)
+        np.testing.assert_array_equal(merged.histogram, statistics.histogram)
+
+if __name__ == '__main__':
+    unittest.main()
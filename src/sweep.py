@@ -0,0 +1,176 @@
+import os
+import glob
+import json
+import hashlib
+import inspect
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sim import Simulation
+from person import PersonParameters
+from results import save_results, load_results, rows_to_sim_results
+
+# Parameters a sweep can vary: the Simulation arguments and the shared person parameters, with their default values
+SIMULATION_DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(Simulation.__init__).parameters.items() if name not in ("self", "seed", "history_length", "person_parameters")}
+PERSON_DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(PersonParameters.__init__).parameters.items() if name != "self"}
+
+# Modules whose code changes the results of a simulation
+SIMULATION_MODULES = ["sim.py", "person.py", "ward.py", "particle.py", "engine.py"]
+
+# Expand a grid of parameter values ({name: [values]}) into a list of full configs, one per combination
+def expand_grid(grid):
+    for name in grid:
+        if name not in SIMULATION_DEFAULTS and name not in PERSON_DEFAULTS:
+            raise ValueError(f"Unknown simulation parameter: {name}")
+    
+    names = sorted(grid)
+    return [get_config(dict(zip(names, values))) for values in itertools.product(*[grid[name] for name in names])]
+
+# Fill in the default values of every parameter that is not set, so equal configs always look the same
+def get_config(parameters):
+    config = {**SIMULATION_DEFAULTS, **PERSON_DEFAULTS, **parameters}
+    config["max_timesteps"] = int(config["max_timesteps"])
+    return config
+
+# Create a simulation from a config
+def make_simulation(config, seed):
+    person_parameters = PersonParameters(**{name: config[name] for name in PERSON_DEFAULTS})
+    return Simulation(seed=seed, person_parameters=person_parameters, **{name: config[name] for name in SIMULATION_DEFAULTS})
+
+# Run a chunk of (config index, simulation index, seed) simulations in one task
+def run_config_chunk(configs, tasks):
+    results = []
+    for c, i, seed_sequence in tasks:
+        sim = make_simulation(configs[c], seed_sequence)
+        sim.run(progress=False)
+        results.append((c, i, sim.infection_record))
+    return results
+
+# Hash of the source code of the simulation modules, so cached results are invalidated when the code changes
+def get_code_version():
+    code_hash = hashlib.sha256()
+    for module in SIMULATION_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as file:
+            code_hash.update(file.read())
+    return code_hash.hexdigest()
+
+# On-disk cache of sweep results, keyed by a hash of the config, seed, number of simulations and code version
+# The least recently used entries are evicted once the cache is bigger than max_bytes (None keeps everything)
+class ResultCache:
+    def __init__(self, directory="data/cache", max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.code_version = get_code_version()
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def get_key(self, config, seed, repeat_sims):
+        content = json.dumps({"config": config, "seed": seed, "repeat_sims": repeat_sims, "code_version": self.code_version}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+    
+    def get_filename(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+    
+    # The sidecar file of an entry, holding the config that produced it and its number of simulations
+    def get_sidecar_filename(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+    
+    # Get the cached results for a key, or None if they are not cached (or the entry is incomplete)
+    def get(self, key, repeat_sims=None):
+        filename = self.get_filename(key)
+        sidecar_filename = self.get_sidecar_filename(key)
+        if not os.path.exists(filename) or not os.path.exists(sidecar_filename):
+            return None
+        
+        with open(sidecar_filename, "r") as file:
+            num_simulations = json.load(file).get("simulations")
+        sim_results = rows_to_sim_results(load_results(filename))
+        if num_simulations is None or len(sim_results) != num_simulations or (repeat_sims is not None and num_simulations != repeat_sims):
+            return None
+        
+        # Mark the entry as recently used
+        os.utime(filename)
+        return sim_results
+    
+    # Cache the results for a key, along with the config that produced them, then evict old entries if needed
+    # Both files are written under temporary names and moved into place, the results last, so the results file of an entry only exists once the entry is complete
+    def put(self, key, sim_results, config=None):
+        filename = self.get_filename(key)
+        sidecar_filename = self.get_sidecar_filename(key)
+        save_results(filename + ".tmp", sim_results)
+        with open(sidecar_filename + ".tmp", "w") as file:
+            json.dump({"config": config, "simulations": len(sim_results)}, file, sort_keys=True)
+        os.replace(sidecar_filename + ".tmp", sidecar_filename)
+        os.replace(filename + ".tmp", filename)
+        self.evict()
+    
+    # Remove the least recently used entries until the cache fits in max_bytes
+    # A results file without its sidecar (left by an interrupted write) counts as no size and is removed
+    def evict(self):
+        if self.max_bytes is None:
+            return
+        
+        entries = sorted(glob.glob(os.path.join(self.directory, "*.npy")), key=os.path.getmtime)
+        sidecars = [filename[:-4] + ".json" for filename in entries]
+        sizes = [os.path.getsize(filename) + os.path.getsize(sidecar) if os.path.exists(sidecar) else 0 for filename, sidecar in zip(entries, sidecars)]
+        total = sum(sizes)
+        for filename, sidecar, size in zip(entries, sidecars, sizes):
+            if os.path.exists(sidecar) and total <= self.max_bytes:
+                continue
+            os.remove(filename)
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+            total -= size
+    
+    def size(self):
+        return sum(os.path.getsize(filename) for filename in glob.glob(os.path.join(self.directory, "*")))
+
+# Run every config in a parameter grid, only running the configs whose results are not cached
+# Every config uses the same seeds, so differences between configs are not down to different random numbers
+# Returns a list of (config, sim_results) pairs in grid order
+def run_sweep(grid, repeat_sims=25, seed=0, workers=None, chunk_size=None, cache=None):
+    configs = expand_grid(grid)
+    cache = cache if cache is not None else ResultCache()
+    keys = [cache.get_key(config, seed, repeat_sims) for config in configs]
+    sweep_results = [cache.get(key, repeat_sims) for key in keys]
+    
+    # Run the missing configs, one task per chunk of simulations across all of them
+    missing = [c for c, sim_results in enumerate(sweep_results) if sim_results is None]
+    print(f"{len(configs) - len(missing)} of {len(configs)} configs cached, running {len(missing) * repeat_sims} simulations")
+    seed_sequences = np.random.SeedSequence(seed).spawn(repeat_sims)
+    tasks = [(c, i, seed_sequence) for c in missing for i, seed_sequence in enumerate(seed_sequences)]
+    for c in missing:
+        sweep_results[c] = [None] * repeat_sims
+    
+    if workers is None or workers <= 1:
+        completed = (run_config_chunk(configs, [task]) for task in tasks)
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, len(tasks) // (4 * workers))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = [executor.submit(run_config_chunk, configs, tasks[i:i + chunk_size]) for i in range(0, len(tasks), chunk_size)]
+        completed = (future.result() for future in as_completed(futures))
+    
+    # Cache each config as soon as all of its simulations are done
+    remaining = {c: repeat_sims for c in missing}
+    try:
+        for results in completed:
+            for c, i, infection_record in results:
+                sweep_results[c][i] = infection_record
+                remaining[c] -= 1
+                if remaining[c] == 0:
+                    cache.put(keys[c], sweep_results[c], configs[c])
+    finally:
+        if workers is not None and workers > 1:
+            executor.shutdown()
+    
+    return list(zip(configs, sweep_results))
+
+def main():
+    # Compare masking at different vaccination rates
+    sweep_results = run_sweep({"masked": [False, True], "vaccination_rate": [0.5, 0.882]}, repeat_sims=25, workers=os.cpu_count(), cache=ResultCache(max_bytes=100 * 2**20))
+    for config, sim_results in sweep_results:
+        final_timesteps = [sim_result[-1]["timestep"] for sim_result in sim_results]
+        print(f"masked={config['masked']}, vaccination_rate={config['vaccination_rate']}: time to infect everyone {np.mean(final_timesteps)} +/- {np.std(final_timesteps)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from sweep import ResultCache, expand_grid, run_sweep
+from results import save_results
+
+class TestSweep(unittest.TestCase):
+    def test_expand_grid(self):
+        configs = expand_grid({"masked": [False, True], "num_workers": [5, 6, 7]})
+        
+        self.assertEqual(len(configs), 6)
+        self.assertEqual({(config["masked"], config["num_workers"]) for config in configs}, {(masked, num_workers) for masked in [False, True] for num_workers in [5, 6, 7]})
+        self.assertTrue(all(config["vaccination_rate"] == 0.882 for config in configs))
+        self.assertRaises(ValueError, expand_grid, {"not_a_parameter": [1]})
+    
+    def test_mask_efficiency_changes_the_results(self):
+        with tempfile.TemporaryDirectory() as directory:
+            grid = {"max_timesteps": [400], "masked": [True], "mask_efficiency": [0.05, 1.0]}
+            (_, effective_results), (_, useless_results) = run_sweep(grid, repeat_sims=2, cache=ResultCache(directory))
+            
+            # Better masks infect fewer people with the same seeds
+            self.assertLess(sum(len(sim_result) for sim_result in effective_results), sum(len(sim_result) for sim_result in useless_results))
+    
+    def test_cached_results_match_and_are_evicted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            grid = {"max_timesteps": [200], "initial_infected": [2, 3]}
+            sweep_results = run_sweep(grid, repeat_sims=2, cache=cache)
+            self.assertEqual(len(os.listdir(directory)), 4)
+            
+            # Running again reads every config from the cache
+            self.assertEqual(run_sweep(grid, repeat_sims=2, cache=cache), sweep_results)
+            
+            # Shrinking the cache keeps only the most recently used entry
+            key = cache.get_key(sweep_results[1][0], 0, 2)
+            cache.max_bytes = os.path.getsize(cache.get_filename(key)) + os.path.getsize(os.path.join(directory, f"{key}.json"))
+            cache.get(key)
+            cache.evict()
+            self.assertIsNone(cache.get(cache.get_key(sweep_results[0][0], 0, 2)))
+            self.assertEqual(cache.get(key), sweep_results[1][1])
+    
+    def test_incomplete_entries_are_not_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory, max_bytes=10**9)
+            sim_results = [[{"type": "patient", "id": "00000001", "timestep": 0}]] * 3
+            cache.put("complete", sim_results, {})
+            self.assertEqual(cache.get("complete", 3), sim_results)
+            self.assertIsNone(cache.get("complete", 4))
+            
+            # A results file with fewer simulations than its sidecar says, and one with no sidecar, as left by interrupted writes
+            save_results(cache.get_filename("complete"), sim_results[:2])
+            save_results(cache.get_filename("orphaned"), sim_results)
+            self.assertIsNone(cache.get("complete"))
+            self.assertIsNone(cache.get("orphaned"))
+            
+            cache.evict()
+            self.assertFalse(os.path.exists(cache.get_filename("orphaned")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import os
+import glob
+import json
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from ward import create_layout
+from recording import FrameWriter
+
+# Names of the per-timestep arrays in each chunk
+STATE_NAMES = ["timesteps", "worker_positions", "infected", "airborne_counts", "surface_counts"]
+
+# Record a snapshot of a simulation at every timestep (worker positions, who is infected and the number of particles in each room)
+# Snapshots are buffered and written to a directory as compressed chunks of chunk_size timesteps, along with a header of everything that does not change,
+# so a costly run can be replayed or plotted later without simulating it again
+class StateRecorder:
+    def __init__(self, directory, sim, chunk_size=360):
+        self.directory = directory
+        self.sim = sim
+        self.chunk_size = chunk_size
+        self.num_rooms = len(sim.ward.room_names)
+        self.num_chunks = 0
+        self.clear()
+        
+        # A simulation resumed from a checkpoint carries on the recording of its earlier timesteps, dropping any snapshots taken after the checkpoint
+        # Otherwise a new recording is started, removing the chunks of an earlier one
+        os.makedirs(directory, exist_ok=True)
+        for filename in sorted(glob.glob(os.path.join(directory, "chunk_*.npz"))):
+            if sim.timestep > 0:
+                with np.load(filename) as chunk:
+                    states = {name: chunk[name] for name in STATE_NAMES}
+                kept = states["timesteps"] < sim.timestep
+                if kept.any():
+                    if not kept.all():
+                        np.savez_compressed(filename, **{name: values[kept] for name, values in states.items()})
+                    self.num_chunks += 1
+                    continue
+            os.remove(filename)
+        
+        people = sim.workers + sim.patients
+        with open(os.path.join(directory, "header.json"), "w") as file:
+            json.dump({
+                "ward": sim.ward.parameters,
+                "max_timesteps": sim.max_timesteps,
+                "num_workers": len(sim.workers),
+                "types": [person.type for person in people],
+                "ids": [person.id for person in people],
+                "masked": [bool(person.masked) for person in people],
+                "vaccinated": [bool(person.vaccinated) for person in people],
+                "patient_positions": [[float(x) for x in patient.position] for patient in sim.patients]
+            }, file)
+    
+    def clear(self):
+        self.buffers = {name: [] for name in STATE_NAMES}
+    
+    # Take a snapshot of the simulation after a timestep
+    def record(self, timestep):
+        worker_positions, infected = self.sim.get_people_state()
+        self.buffers["timesteps"].append(timestep)
+        self.buffers["worker_positions"].append(np.array(worker_positions, dtype=np.float32))
+        self.buffers["infected"].append(np.array(infected, dtype=bool))
+        self.buffers["airborne_counts"].append(self.sim.airborne_particles.room_counts(self.num_rooms))
+        self.buffers["surface_counts"].append(self.sim.surface_particles.room_counts(self.num_rooms))
+        
+        if len(self.buffers["timesteps"]) == self.chunk_size:
+            self.flush()
+    
+    # Write the buffered snapshots as one compressed chunk
+    def flush(self):
+        if len(self.buffers["timesteps"]) == 0:
+            return
+        
+        np.savez_compressed(os.path.join(self.directory, f"chunk_{self.num_chunks:05d}.npz"),
+            timesteps=np.array(self.buffers["timesteps"], dtype=np.int32),
+            worker_positions=np.array(self.buffers["worker_positions"]),
+            infected=np.array(self.buffers["infected"]),
+            airborne_counts=np.array(self.buffers["airborne_counts"], dtype=np.int32),
+            surface_counts=np.array(self.buffers["surface_counts"], dtype=np.int32))
+        self.num_chunks += 1
+        self.clear()
+    
+    def close(self):
+        self.flush()
+
+# Yield the snapshots of a recording one chunk at a time, as dicts of arrays with a leading timestep axis
+def iter_state_chunks(directory):
+    for filename in sorted(glob.glob(os.path.join(directory, "chunk_*.npz"))):
+        with np.load(filename) as chunk:
+            yield {name: chunk[name] for name in STATE_NAMES}
+
+# Load the header and every snapshot of a recording
+def load_states(directory):
+    with open(os.path.join(directory, "header.json"), "r") as file:
+        header = json.load(file)
+    
+    chunks = list(iter_state_chunks(directory))
+    states = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in STATE_NAMES} if len(chunks) > 0 else None
+    return header, states
+
+# Replay a recording, showing it live or recording it to a file (see FrameWriter for the formats) with a frame every frame_stride timesteps
+# Infected people are drawn in red and each room is shaded by the number of particles in it
+def replay(directory, record_filename=None, frame_stride=10, fps=30, dpi=100):
+    header, states = load_states(directory)
+    ward = create_layout(**header["ward"])
+    num_workers = header["num_workers"]
+    total_people = len(header["types"])
+    num_rooms = ward.outside_id # Rooms inside the ward (or floor)
+    particle_counts = (states["airborne_counts"] + states["surface_counts"])[:, :num_rooms]
+    max_particles = max(int(particle_counts.max()), 1)
+    
+    if record_filename is not None:
+        fig = Figure(dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+    else:
+        fig, ax = plt.subplots()
+    ax.set_aspect('equal')
+    ax.axis('off')
+    
+    # Render the ward
+    ward.render(ax)
+    
+    # Shade the rooms by their number of particles
+    room_renders = [ax.add_patch(plt.Rectangle((x0, y0), x1 - x0, y1 - y0, facecolor='hotpink', alpha=0, zorder=6)) for x0, y0, x1, y1 in ward.room_bounds[:num_rooms]]
+    
+    # Render the people, the same as the simulation does
+    worker_renders = [ax.add_patch(plt.Circle((0, 0), 0.5, facecolor='cyan', edgecolor='green' if header["vaccinated"][w] else 'cyan', zorder=10)) for w in range(num_workers)]
+    patient_renders = [ax.add_patch(plt.Circle(position, 0.5, facecolor='lightcoral', edgecolor='green' if header["vaccinated"][num_workers + p] else 'lightcoral', zorder=9)) for p, position in enumerate(header["patient_positions"])]
+    
+    # Add time step and infection count text outside of the plot
+    timestep_text = ax.text(0.02, 0.95, '', transform=fig.transFigure)
+    infection_text = ax.text(0.02, 0.90, '', transform=fig.transFigure)
+    ax.autoscale_view()
+    
+    def update(frame):
+        infected = states["infected"][frame]
+        for room_render, count in zip(room_renders, particle_counts[frame]):
+            room_render.set_alpha(0.5 * count / max_particles)
+        for w, worker_render in enumerate(worker_renders):
+            worker_render.set_center(tuple(states["worker_positions"][frame, w]))
+            worker_render.set_facecolor('red' if infected[w] else 'cyan')
+        for p, patient_render in enumerate(patient_renders):
+            patient_render.set_facecolor('red' if infected[num_workers + p] else 'lightcoral')
+        
+        timestep_text.set_text(f'Time step: {states["timesteps"][frame]}/{header["max_timesteps"]}')
+        infection_text.set_text(f'Infected: {np.count_nonzero(infected)}/{total_people} ({np.count_nonzero(infected[num_workers:])} patients, {np.count_nonzero(infected[:num_workers])} workers)')
+        return room_renders + patient_renders + worker_renders + [timestep_text, infection_text]
+    
+    # Every frame_stride-th snapshot, always ending on the last one
+    frames = list(range(0, len(states["timesteps"]), frame_stride))
+    if frames[-1] != len(states["timesteps"]) - 1:
+        frames.append(len(states["timesteps"]) - 1)
+    
+    if record_filename is None:
+        ani = animation.FuncAnimation(fig, update, frames=frames, blit=False)
+        plt.show()
+        return
+    
+    # Blit the changing renders over the static background (the ward)
+    artists = update(frames[0])
+    for artist in artists:
+        artist.set_animated(True)
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    with FrameWriter(record_filename, fps) as writer:
+        for frame in frames:
+            canvas.restore_region(background)
+            for artist in update(frame):
+                fig.draw_artist(artist)
+            writer.write(np.asarray(canvas.buffer_rgba()))
+
+# Plot the number of infections and the number of particles in each room over a recording
+def plot_states(directory):
+    header, states = load_states(directory)
+    ward = create_layout(**header["ward"])
+    fig, (infection_ax, particle_ax) = plt.subplots(2, 1, sharex=True)
+    
+    infection_ax.plot(states["timesteps"], np.count_nonzero(states["infected"], axis=1), color='red')
+    infection_ax.set_ylabel("Infected people")
+    
+    particle_counts = states["airborne_counts"] + states["surface_counts"]
+    for room in range(ward.outside_id):
+        particle_ax.plot(states["timesteps"], particle_counts[:, room], label=ward.room_names[room])
+    particle_ax.set_xlabel("Timestep")
+    particle_ax.set_ylabel("Particles")
+    particle_ax.legend(loc="upper right")
+    return fig
+
+def main():
+    # Replay a recording made with Simulation.run(state_directory="data/states")
+    replay("data/states", record_filename="plots/replay.gif")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from sim import Simulation
+from trajectory import load_states, replay
+
+class TestStateRecorder(unittest.TestCase):
+    def test_states_match_the_run(self):
+        for engine in ["object", "vectorized"]:
+            with self.subTest(engine=engine), tempfile.TemporaryDirectory() as directory:
+                sim = Simulation(max_timesteps=250, engine=engine, seed=1)
+                sim.run(progress=False, state_directory=directory, state_chunk_size=100)
+                header, states = load_states(directory)
+                
+                self.assertEqual(len([filename for filename in os.listdir(directory) if filename.startswith("chunk_")]), 3)
+                self.assertEqual(list(states["timesteps"]), list(range(sim.timestep)))
+                self.assertEqual(header["ids"], [person.id for person in sim.workers + sim.patients])
+                
+                # The last snapshot is the final state of the run
+                np.testing.assert_allclose(states["worker_positions"][-1], [worker.position for worker in sim.workers], atol=1e-5)
+                self.assertEqual(list(states["infected"][-1]), [person.infected for person in sim.workers + sim.patients])
+                self.assertEqual(states["airborne_counts"][-1].sum(), len(sim.airborne_particles))
+                self.assertEqual(np.count_nonzero(states["infected"][-1]), len(sim.infection_record))
+    
+    def test_resumed_run_carries_on_the_recording(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state_directory = os.path.join(directory, "states")
+            filename = os.path.join(directory, "checkpoint.pkl")
+            Simulation(max_timesteps=300, seed=3).run(progress=False, checkpoint_filename=filename, checkpoint_interval=120, state_directory=state_directory, state_chunk_size=100)
+            _, states = load_states(state_directory)
+            
+            # Carry on from the checkpoint at timestep 240, which is part way through the last chunk
+            Simulation.load_checkpoint(filename).run(progress=False, state_directory=state_directory, state_chunk_size=100)
+            _, resumed_states = load_states(state_directory)
+            
+            self.assertEqual(list(resumed_states["timesteps"]), list(range(300)))
+            for name in states:
+                np.testing.assert_array_equal(resumed_states[name], states[name])
+            self.assertRaises(ValueError, Simulation(max_timesteps=10, seed=3).run, render=True, state_directory=state_directory)
+    
+    def test_replay_records_every_stride(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Simulation(max_timesteps=50, seed=1).run(progress=False, state_directory=directory)
+            replay(directory, record_filename=os.path.join(directory, "frame_{:03d}.png"), frame_stride=20)
+            
+            self.assertEqual(sorted(filename for filename in os.listdir(directory) if filename.startswith("frame_")), ["frame_000.png", "frame_001.png", "frame_002.png", "frame_003.png"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
+import math
 import numpy as np
 import matplotlib.pyplot as plt
 
+# Route leg types: passing through a room, walking to a point on the spine and walking to the patient
+ROOM = 0
+PATH = 1
+PATIENT = 2
+
 # Define Ward class
 class Ward:
     def __init__(self, bays, beds, bay_length=20, bay_width=10, corridor_width=5):
@@ -10,6 +16,10 @@ class Ward:
         self.bay_width = bay_width
         self.corridor_width = corridor_width
         self.corridor_length = self.bay_width * self.num_bays
+        self.parameters = {"bays": bays, "beds": beds, "bay_length": bay_length, "bay_width": bay_width, "corridor_width": corridor_width}
+        
+        # Where workers start
+        self.entrance = np.array([0.0, 5.0])
         
         # Generate the positions of the beds
         self.bays, self.bed_positions, self.bay_positions = self.generate_bays()
@@ -28,6 +38,20 @@ class Ward:
         
         self.ward_spine = self.create_spine()
         
+        # Integer room IDs: the bays first (so they take priority on shared walls), then the corridor, then outside the ward
+        self.room_names = [f"Bay {i+1}" for i in range(len(self.bay_positions))] + ["Corridor", "Outside"]
+        self.corridor_id = len(self.bay_positions)
+        self.outside_id = len(self.bay_positions) + 1
+        
+        # Room bounds (x0, y0, x1, y1), outside the ward has NaN bounds so nothing is ever inside it
+        self.room_bounds = np.array([(bay[0][0], bay[0][1], bay[1][0], bay[2][1]) for bay in self.bay_positions] + [(self.corridor_position[0][0], self.corridor_position[0][1], self.corridor_position[1][0], self.corridor_position[2][1])] + [(np.nan,) * 4])
+        
+        # Build the room lookup index
+        self.build_room_index()
+        
+        # Build the routing table between every room and every bay
+        self.build_route_table()
+        
     def render_ward(self):
         # Initialise the figure
         fig, ax = plt.subplots()
@@ -112,47 +136,233 @@ class Ward:
         beds = []
         bay_positions = []
         for i in range(self.num_bays):
-            # Left bay
-            position = (-self.corridor_width/2 - self.bay_length, i * self.bay_width)
-            bays.append(plt.Rectangle(position, self.bay_length, self.bay_width, facecolor='white', edgecolor='black', linewidth=1))
-            beds.extend(self.generate_beds(position))
-            
-            ## Add the bay position, counter-clockwise from the bottom left
-            bay_positions.append([
-                (position[0], position[1]),
-                (position[0] + self.bay_length, position[1]),
-                (position[0] + self.bay_length, position[1] + self.bay_width),
-                (position[0], position[1] + self.bay_width)
-            ])
-            
-            # Right bay
-            position = (self.corridor_width/2, i * self.bay_width)
-            bays.append(plt.Rectangle(position, self.bay_length, self.bay_width, facecolor='white', edgecolor='black', linewidth=1))
-            beds.extend(self.generate_beds(position))
-            
-            ## Add the bay position (as above)
-            bay_positions.append([
-                (position[0], position[1]),
-                (position[0] + self.bay_length, position[1]),
-                (position[0] + self.bay_length, position[1] + self.bay_width),
-                (position[0], position[1] + self.bay_width)
-            ])
+            # Left bay, then right bay
+            for position in [(-self.corridor_width/2 - self.bay_length, i * self.bay_width), (self.corridor_width/2, i * self.bay_width)]:
+                bay, bay_beds, bay_position = self.generate_bay(position)
+                bays.append(bay)
+                beds.extend(bay_beds)
+                bay_positions.append(bay_position)
             
         return bays, beds, bay_positions
     
-    # Find the room (bay or corridor) that a position is in
-    def get_room(self, position):
+    # Generate a bay with its bottom left corner at a position, returning its patch, the positions of its beds and its corners
+    def generate_bay(self, position):
+        bay = plt.Rectangle(position, self.bay_length, self.bay_width, facecolor='white', edgecolor='black', linewidth=1)
+        
+        ## The bay position, counter-clockwise from the bottom left
+        bay_position = [
+            (position[0], position[1]),
+            (position[0] + self.bay_length, position[1]),
+            (position[0] + self.bay_length, position[1] + self.bay_width),
+            (position[0], position[1] + self.bay_width)
+        ]
+        return bay, self.generate_beds(position), bay_position
+    
+    # Rasterise the ward into a grid of cells, each listing the rooms (in priority order) that overlap it
+    def build_room_index(self):
+        rooms = self.room_bounds[:self.outside_id]
+        self.index_origin = (rooms[:, 0].min(), rooms[:, 1].min())
+        self.index_extent = (rooms[:, 2].max(), rooms[:, 3].max())
+        
+        # Cells are no bigger than the smallest room, so each cell only overlaps a few rooms
+        self.index_cell_size = min(np.min(rooms[:, 2] - rooms[:, 0]), np.min(rooms[:, 3] - rooms[:, 1]))
+        self.index_shape = (
+            max(1, math.ceil((self.index_extent[1] - self.index_origin[1]) / self.index_cell_size)),
+            max(1, math.ceil((self.index_extent[0] - self.index_origin[0]) / self.index_cell_size))
+        )
+        
+        # Rooms whose (closed) bounds overlap each (closed) cell
+        self.room_cells = [[[] for _ in range(self.index_shape[1])] for _ in range(self.index_shape[0])]
+        for room, (x0, y0, x1, y1) in enumerate(rooms):
+            ix0, iy0 = self.get_cell((x0, y0))
+            ix1, iy1 = self.get_cell((x1, y1))
+            for iy in range(max(iy0 - 1, 0), min(iy1 + 2, self.index_shape[0])):
+                for ix in range(max(ix0 - 1, 0), min(ix1 + 2, self.index_shape[1])):
+                    cell_x0 = self.index_origin[0] + ix * self.index_cell_size
+                    cell_y0 = self.index_origin[1] + iy * self.index_cell_size
+                    if x0 <= cell_x0 + self.index_cell_size and x1 >= cell_x0 and y0 <= cell_y0 + self.index_cell_size and y1 >= cell_y0:
+                        self.room_cells[iy][ix].append(room)
+        
+        # The same index as a padded array for vectorised lookups, padding with the outside ID
+        max_candidates = max(len(cell) for row in self.room_cells for cell in row)
+        self.room_cell_array = np.full(self.index_shape + (max_candidates,), self.outside_id)
+        for iy, row in enumerate(self.room_cells):
+            for ix, cell in enumerate(row):
+                self.room_cell_array[iy, ix, :len(cell)] = cell
+                
+    # Plan the route from a room to a bay as a list of (room, leg type, point) legs, the patient leg has no point as it depends on the patient
+    def plan_route(self, start_room, end_room):
+        # The worker is already in the same room as the patient
+        if start_room == end_room:
+            return [(end_room, PATIENT, None)]
+        
+        route = [(start_room, ROOM, None)]
+        end_spine = self.ward_spine[end_room // 2]
+        
+        # Workers in a bay walk out to their bay's spine point, unless the patient's bay is directly opposite
+        if start_room != self.corridor_id:
+            start_spine = self.ward_spine[start_room // 2]
+            if start_room // 2 == end_room // 2:
+                return route + [(self.corridor_id, ROOM, None), (end_room, PATIENT, None)]
+            
+            route.append((self.corridor_id, PATH, start_spine))
+        
+        # Walk along the spine to the patient's bay and then to the patient
+        return route + [(self.corridor_id, PATH, end_spine), (end_room, PATIENT, None)]
+    
+    # Precompute the routes from every room to every bay, indexed by [start room, end bay, leg]
+    def build_route_table(self):
+        num_rooms = self.outside_id
+        num_bays = self.corridor_id
+        routes = [[self.plan_route(start_room, end_room) for end_room in range(num_bays)] for start_room in range(num_rooms)]
+        self.max_route_legs = max(len(route) for row in routes for route in row)
+        
+        shape = (num_rooms, num_bays, self.max_route_legs)
+        self.route_rooms = np.full(shape, -1, dtype=int)
+        self.route_types = np.full(shape, ROOM, dtype=int)
+        self.route_points = np.full(shape + (2,), np.nan)
+        for start_room, row in enumerate(routes):
+            for end_room, route in enumerate(row):
+                for leg, (room, leg_type, point) in enumerate(route):
+                    self.route_rooms[start_room, end_room, leg] = room
+                    self.route_types[start_room, end_room, leg] = leg_type
+                    if point is not None:
+                        self.route_points[start_room, end_room, leg] = point
+        
+        # The first leg with a target point after each leg, indexed by [start room, end bay, leg + 1] so the first target of a route is at 0
+        # Routes always end at the patient, so a worker with no targets left keeps targeting the patient
+        legs = np.arange(self.max_route_legs)
+        has_target = self.route_types != ROOM
+        patient_legs = np.count_nonzero(self.route_rooms >= 0, axis=2) - 1
+        self.route_next_targets = np.empty((num_rooms, num_bays, self.max_route_legs + 1), dtype=int)
+        for leg in range(-1, self.max_route_legs):
+            later = has_target & (legs > leg)
+            self.route_next_targets[:, :, leg + 1] = np.where(later.any(axis=2), np.argmax(later, axis=2), patient_legs)
+        
+        # Route rooms padded with a final -1, so the room after every leg can be looked up
+        self.padded_route_rooms = np.concatenate([self.route_rooms, np.full((num_rooms, num_bays, 1), -1)], axis=2)
+    
+    # Get the rooms workers on the given routes (start rooms and end bays) may move into from their current rooms (including outside), as an (N, 2) array:
+    # the room itself and the room after the last leg in it, if there is one
+    # This is looked up per route, rather than kept for every room, so it stays small on large floors
+    def get_allowed_rooms(self, route_starts, route_ends, current_rooms):
+        current_rooms = np.asarray(current_rooms).reshape(-1)
+        route_rooms = self.padded_route_rooms[route_starts, route_ends].reshape(len(current_rooms), -1)
+        legs = np.arange(route_rooms.shape[1])
+        last_legs = np.where(route_rooms == current_rooms[:, None], legs, -1).max(axis=1)
+        next_rooms = route_rooms[np.arange(len(current_rooms)), np.minimum(last_legs + 1, legs[-1])]
+        return np.stack([current_rooms, np.where((last_legs >= 0) & (next_rooms >= 0), next_rooms, current_rooms)], axis=1)
+    
+    # Get the index cell (clipped to the index) that a position is in
+    def get_cell(self, position):
+        ix = min(max(math.floor((position[0] - self.index_origin[0]) / self.index_cell_size), 0), self.index_shape[1] - 1)
+        iy = min(max(math.floor((position[1] - self.index_origin[1]) / self.index_cell_size), 0), self.index_shape[0] - 1)
+        return ix, iy
+        
+    # Find the ID of the room (bay or corridor) that a position is in
+    def get_room_id(self, position):
+        x, y = position[0], position[1]
+        if not (self.index_origin[0] <= x <= self.index_extent[0] and self.index_origin[1] <= y <= self.index_extent[1]):
+            return self.outside_id
         
-        # Check if the position is in a bay
-        for i in range(len(self.bay_positions)):
-            if position[0] >= self.bay_positions[i][0][0] and position[0] <= self.bay_positions[i][1][0] and position[1] >= self.bay_positions[i][0][1] and position[1] <= self.bay_positions[i][2][1]:
-                return f"Bay {i+1}"
+        ix, iy = self.get_cell(position)
+        for room in self.room_cells[iy][ix]:
+            x0, y0, x1, y1 = self.room_bounds[room]
+            if x >= x0 and x <= x1 and y >= y0 and y <= y1:
+                return room
             
-        # Check if the position is in the corridor
-        if position[0] >= self.corridor_position[0][0] and position[0] <= self.corridor_position[1][0] and position[1] >= self.corridor_position[0][1] and position[1] <= self.corridor_position[2][1]:
-            return "Corridor"
+        return self.outside_id
+    
+    # Find the room IDs of an (N, 2) array of positions
+    def get_rooms(self, positions):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        ix = np.clip(np.floor((positions[:, 0] - self.index_origin[0]) / self.index_cell_size).astype(int), 0, self.index_shape[1] - 1)
+        iy = np.clip(np.floor((positions[:, 1] - self.index_origin[1]) / self.index_cell_size).astype(int), 0, self.index_shape[0] - 1)
+        
+        # Test the candidate rooms of each position's cell, taking the first one the position is inside
+        candidates = self.room_cell_array[iy, ix]
+        bounds = self.room_bounds[candidates]
+        inside = (positions[:, None, 0] >= bounds[:, :, 0]) & (positions[:, None, 0] <= bounds[:, :, 2]) & (positions[:, None, 1] >= bounds[:, :, 1]) & (positions[:, None, 1] <= bounds[:, :, 3])
+        
+        return np.where(inside.any(axis=1), candidates[np.arange(len(positions)), np.argmax(inside, axis=1)], self.outside_id)
+    
+    # Split the circle of step endpoints around each position into arcs at every crossing of an allowed room's walls, and find the arcs that stay in an allowed room
+    # positions is (N, 2), radii is (N,) and allowed_rooms is (N, A), returns the arc breakpoints (N, K + 1) from 0 to 2 pi and which arcs are open (N, K)
+    def get_step_arcs(self, positions, radii, allowed_rooms):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        radii = np.asarray(radii, dtype=float).reshape(-1)
+        allowed_rooms = np.asarray(allowed_rooms).reshape(len(positions), -1)
+        
+        # Circles that are well inside the current room are one open arc, only the others need their wall crossings
+        x0, y0, x1, y1 = self.room_bounds[allowed_rooms[:, 0]].T
+        inside = (positions[:, 0] - radii > x0) & (positions[:, 0] + radii < x1) & (positions[:, 1] - radii > y0) & (positions[:, 1] + radii < y1)
+        near = np.flatnonzero(~inside)
+        if len(near) == 0:
+            return np.tile([0, 2 * np.pi], (len(positions), 1)), np.ones((len(positions), 1), dtype=bool)
+        
+        centres = positions[near]
+        near_radii = radii[near, None, None]
+        bounds = self.room_bounds[allowed_rooms[near]]
+        
+        # Angles where the circle crosses the vertical (x = x0, x1) and horizontal (y = y0, y1) walls
+        with np.errstate(invalid="ignore"):
+            cos_crossings = np.arccos((bounds[:, :, [0, 2]] - centres[:, None, None, 0]) / near_radii)
+            sin_crossings = np.arcsin((bounds[:, :, [1, 3]] - centres[:, None, None, 1]) / near_radii)
+        crossings = np.concatenate([cos_crossings, -cos_crossings, sin_crossings, np.pi - sin_crossings], axis=2).reshape(len(near), -1)
+        
+        # Walls the circle doesn't reach give NaN angles, which are moved to the end as empty arcs
+        crossings = np.where(np.isnan(crossings), 2 * np.pi, np.mod(crossings, 2 * np.pi))
+        breakpoints = np.full((len(positions), crossings.shape[1] + 2), 2 * np.pi)
+        breakpoints[:, 0] = 0
+        breakpoints[near, 1:-1] = np.sort(crossings, axis=1)
+        
+        # Each arc is either inside or outside the allowed rooms along its whole length, so test its midpoint against their bounds
+        midpoints = (breakpoints[near, :-1] + breakpoints[near, 1:]) / 2
+        x = centres[:, None, 0] + near_radii[:, :, 0] * np.cos(midpoints)
+        y = centres[:, None, 1] + near_radii[:, :, 0] * np.sin(midpoints)
+        bounds = bounds[:, None]
+        open_arcs = np.zeros((len(positions), breakpoints.shape[1] - 1), dtype=bool)
+        open_arcs[:, 0] = inside
+        open_arcs[near] = ((x[:, :, None] >= bounds[..., 0]) & (x[:, :, None] <= bounds[..., 2]) & (y[:, :, None] >= bounds[..., 1]) & (y[:, :, None] <= bounds[..., 3])).any(axis=2)
         
-        return "Outside"
+        return breakpoints, open_arcs
+    
+    # Sample one step direction per position from the open arcs, given uniform random numbers u in [0, 1)
+    # Directions follow the same distribution as normalising a uniform point in the square [-1, 1]^2, restricted to the open arcs
+    # Positions with no open arcs get NaN directions
+    def sample_step_directions(self, breakpoints, open_arcs, u):
+        # Every circle is a single open arc, so sample from the whole distribution
+        if open_arcs.shape[1] == 1:
+            angles = square_angle_ppf(4 * np.asarray(u))
+            return np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        
+        cdf = square_angle_cdf(breakpoints)
+        masses = np.where(open_arcs, np.diff(cdf, axis=1), 0)
+        cumulative = np.cumsum(masses, axis=1)
+        
+        # Find the arc each sample falls in, then invert the CDF within it
+        target = np.asarray(u) * cumulative[:, -1]
+        rows = np.arange(len(breakpoints))
+        arcs = np.minimum(np.count_nonzero(cumulative <= target[:, None], axis=1), masses.shape[1] - 1)
+        angles = square_angle_ppf(cdf[rows, arcs] + target - (cumulative[rows, arcs] - masses[rows, arcs]))
+        angles = np.minimum(np.maximum(angles, breakpoints[rows, arcs]), breakpoints[rows, arcs + 1])
+        
+        directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        directions[cumulative[:, -1] <= 0] = np.nan
+        return directions
+    
+    # Check whether steps in the given (N, 2) directions land in an open arc
+    def is_step_open(self, breakpoints, open_arcs, directions):
+        if open_arcs.shape[1] == 1:
+            return open_arcs[:, 0]
+        
+        angles = np.mod(np.arctan2(directions[:, 1], directions[:, 0]), 2 * np.pi)
+        arcs = np.minimum(np.count_nonzero(breakpoints[:, 1:] <= angles[:, None], axis=1), open_arcs.shape[1] - 1)
+        return open_arcs[np.arange(len(open_arcs)), arcs]
+    
+    # Find the name of the room (bay or corridor) that a position is in
+    def get_room(self, position):
+        return self.room_names[self.get_room_id(position)]
         
     # Create the spine points of the ward
     def create_spine(self):
@@ -163,10 +373,171 @@ class Ward:
         spine = [(0, y) for y in spine_y]
         return np.array(spine)
         
+# A floor of several wards joined by a main corridor, for simulating many more beds than a single ward
+# Each ward is a corridor with bays on both sides like a Ward, the wards are in columns along the main corridor, alternately above and below it
+# Room IDs are every bay (ward by ward), then the wards' corridors, then the main corridor, then outside
+# The room index and the route tables work the same as for a Ward, so room lookups and routing don't get slower as the floor grows
+class Floor(Ward):
+    def __init__(self, wards, bays, beds, bay_length=20, bay_width=10, corridor_width=5):
+        self.num_wards = wards
+        self.num_bays = bays # Bays per side of each ward's corridor
+        self.beds = beds # Number of beds per side of each bay
+        self.bay_length = bay_length
+        self.bay_width = bay_width
+        self.corridor_width = corridor_width
+        self.corridor_length = self.bay_width * self.num_bays # Length of each ward's corridor
+        self.parameters = {"wards": wards, "bays": bays, "beds": beds, "bay_length": bay_length, "bay_width": bay_width, "corridor_width": corridor_width}
+        
+        # The main corridor runs along the x-axis below y = 0, past every column of wards
+        self.column_width = 2 * self.bay_length + self.corridor_width
+        self.main_corridor_length = self.column_width * math.ceil(self.num_wards / 2)
+        
+        # Generate the bays, beds and corridors of each ward
+        self.bays, self.bed_positions, self.bay_positions = [], [], []
+        self.corridors, self.corridor_positions = [], []
+        for ward in range(self.num_wards):
+            x = self.get_ward_x(ward)
+            for i in range(self.num_bays):
+                for position in [(x - self.corridor_width/2 - self.bay_length, self.get_bay_y(ward, i)), (x + self.corridor_width/2, self.get_bay_y(ward, i))]:
+                    bay, bay_beds, bay_position = self.generate_bay(position)
+                    self.bays.append(bay)
+                    self.bed_positions.extend(bay_beds)
+                    self.bay_positions.append(bay_position)
+            
+            y = 0 if ward % 2 == 0 else -self.corridor_width - self.corridor_length
+            self.corridors.append(plt.Rectangle((x - self.corridor_width/2, y), self.corridor_width, self.corridor_length, linewidth=1, edgecolor='black', facecolor='white'))
+            self.corridor_positions.append((x - self.corridor_width/2, y, x + self.corridor_width/2, y + self.corridor_length))
+        
+        # The main corridor
+        x0 = -self.corridor_width/2 - self.bay_length
+        self.corridors.append(plt.Rectangle((x0, -self.corridor_width), self.main_corridor_length, self.corridor_width, linewidth=1, edgecolor='black', facecolor='white'))
+        self.corridor_positions.append((x0, -self.corridor_width, x0 + self.main_corridor_length, 0))
+        
+        self.ward_spine = self.create_spine()
+        
+        # The junction of each ward with the main corridor: the middle of the ward corridor's end (on their shared wall) and the point on the main corridor's centre line next to it
+        self.corridor_junctions = np.array([(self.get_ward_x(ward), 0 if ward % 2 == 0 else -self.corridor_width) for ward in range(self.num_wards)])
+        self.main_junctions = np.array([(self.get_ward_x(ward), -self.corridor_width/2) for ward in range(self.num_wards)])
+        
+        # Workers start on the main corridor, next to the first ward
+        self.entrance = self.main_junctions[0].copy()
+        
+        # Integer room IDs: the bays first (so they take priority on shared walls), then the ward corridors, then the main corridor, then outside
+        bays_per_ward = 2 * self.num_bays
+        self.room_names = [f"Ward {i // bays_per_ward + 1} Bay {i % bays_per_ward + 1}" for i in range(len(self.bay_positions))] + [f"Ward {i+1} Corridor" for i in range(self.num_wards)] + ["Main Corridor", "Outside"]
+        self.corridor_id = len(self.bay_positions) # The first ward's corridor
+        self.main_corridor_id = self.corridor_id + self.num_wards
+        self.outside_id = self.main_corridor_id + 1
+        self.bay_wards = np.arange(len(self.bay_positions)) // bays_per_ward
+        
+        # Room bounds (x0, y0, x1, y1), outside the floor has NaN bounds so nothing is ever inside it
+        self.room_bounds = np.array([(bay[0][0], bay[0][1], bay[1][0], bay[2][1]) for bay in self.bay_positions] + self.corridor_positions + [(np.nan,) * 4])
+        
+        # Build the room lookup index
+        self.build_room_index()
+        
+        # Build the routing table between every room and every bay
+        self.build_route_table()
+    
+    # x position of the centre of a ward's corridor
+    def get_ward_x(self, ward):
+        return (ward // 2) * self.column_width
+    
+    # y position of the bottom of a ward's i-th pair of bays, counting out from the main corridor
+    def get_bay_y(self, ward, i):
+        return i * self.bay_width if ward % 2 == 0 else -self.corridor_width - (i + 1) * self.bay_width
+    
+    # The spine point in front of each pair of bays, on its ward's corridor
+    def create_spine(self):
+        return np.array([(self.get_ward_x(ward), self.get_bay_y(ward, i) + self.bay_width/2) for ward in range(self.num_wards) for i in range(self.num_bays)])
+    
+    # Plan the route from a room to a bay, as Ward.plan_route, going through the main corridor to reach another ward
+    def plan_route(self, start_room, end_room):
+        # The worker is already in the same room as the patient
+        if start_room == end_room:
+            return [(end_room, PATIENT, None)]
+        
+        route = [(start_room, ROOM, None)]
+        end_ward = self.bay_wards[end_room]
+        end_corridor = self.corridor_id + end_ward
+        end_spine = self.ward_spine[end_room // 2]
+        
+        # Workers in a bay walk out to their bay's spine point, unless the patient's bay is directly opposite
+        if start_room < self.corridor_id:
+            start_ward = self.bay_wards[start_room]
+            start_corridor = self.corridor_id + start_ward
+            if start_room // 2 == end_room // 2:
+                return route + [(end_corridor, ROOM, None), (end_room, PATIENT, None)]
+            
+            route.append((start_corridor, PATH, self.ward_spine[start_room // 2]))
+        elif start_room < self.main_corridor_id:
+            start_ward = start_room - self.corridor_id
+            start_corridor = start_room
+        else:
+            start_ward = None
+        
+        # Workers outside the patient's ward walk out of their ward's corridor and along the main corridor to the patient's ward
+        if start_ward != end_ward:
+            if start_ward is not None:
+                route.append((start_corridor, PATH, self.corridor_junctions[start_ward]))
+            route.append((self.main_corridor_id, PATH, self.main_junctions[end_ward]))
+        
+        # Walk along the ward's spine to the patient's bay and then to the patient
+        return route + [(end_corridor, PATH, end_spine), (end_room, PATIENT, None)]
+    
+    def render(self, ax, internal_render=False):
+        # Plot the corridors
+        for corridor in self.corridors:
+            ax.add_patch(corridor)
+        
+        # Plot the bays and their doors onto their ward's corridor
+        for i, bay in enumerate(self.bays):
+            ax.add_patch(bay)
+            ax.text(bay.get_x() + bay.get_width()/2, bay.get_y() + bay.get_height()/2, self.room_names[i], ha='center', va='center', fontstyle='italic', fontweight='bold', fontsize=6, alpha=0.3)
+            door_x = bay.get_x() + bay.get_width() - self.corridor_width/6 if i % 2 == 0 else bay.get_x() - self.corridor_width/6
+            ax.add_patch(plt.Rectangle((door_x, bay.get_y() + bay.get_height()/3), self.corridor_width/3, self.bay_width/3, facecolor='white'))
+        
+        # Plot the beds
+        bed_width = 1
+        bed_length = 2
+        for bed in self.bed_positions:
+            ax.add_patch(plt.Rectangle((bed[0] - bed_width/2, bed[1] - bed_length/2), bed_width, bed_length, facecolor='lightblue', edgecolor='black', linewidth=1, zorder=5))
+        
+        if internal_render:
+            # Plot the spine and the junctions
+            ax.scatter(self.ward_spine[:,0], self.ward_spine[:,1], c='black', zorder=10)
+            ax.scatter(*np.concatenate([self.corridor_junctions, self.main_junctions]).T, c='grey', zorder=10)
+            
+            ax.set_xlim(self.index_origin[0], self.index_extent[0])
+            ax.set_ylim(self.index_origin[1], self.index_extent[1])
+            ax.set_aspect('equal')
+            ax.axis('off')
+
+# Create a single Ward, or a Floor of several wards
+def create_layout(wards=1, **parameters):
+    return Floor(wards, **parameters) if wards > 1 else Ward(**parameters)
+
+# Cumulative distribution of the angle (from 0 to 2 pi) of a uniform point in the square [-1, 1]^2, scaled so the full circle is 4
+# Each quarter turn sweeps one unit of area: tan(angle) / 2 up to the diagonal, then the mirror image after it
+def square_angle_cdf(angles):
+    quarters = np.minimum(np.floor(angles / (np.pi / 2)), 3)
+    remainder = angles - quarters * np.pi / 2
+    return quarters + np.where(remainder <= np.pi / 4, np.tan(remainder) / 2, 1 - np.tan(np.pi / 2 - remainder) / 2)
+
+# Inverse of square_angle_cdf
+def square_angle_ppf(values):
+    quarters = np.minimum(np.floor(values), 3)
+    remainder = values - quarters
+    return quarters * np.pi / 2 + np.where(remainder <= 0.5, np.arctan(2 * remainder), np.pi / 2 - np.arctan(2 * (1 - remainder)))
+
 def main():
     # Create a ward with 3 bays and 5 beds per bay
     ward = Ward(bays=3, beds=4)
     ward.render_ward()
     
+    # Create a floor of 6 wards, each with 3 bays per side and 3 beds per side of each bay
+    floor = Floor(wards=6, bays=3, beds=3, bay_length=12, bay_width=8, corridor_width=4)
+    floor.render_ward()
+    
 if __name__ == "__main__":
     main()
\ No newline at end of file